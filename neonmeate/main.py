@@ -11,6 +11,7 @@ import random
 import sys
 import time
 
+import neonmeate.nmpd.asyncmpd as asyncmpd
 import neonmeate.nmpd.mpdlib as nmpd
 import neonmeate.ui.app as app
 import neonmeate.ui.toolkit as toolkit
@@ -73,10 +74,20 @@ def main(args=None):
 
     with thread.ScheduledExecutor(log_errors, log_errors) as executor:
         connstatus = nmpd.MpdConnectionStatus()
-        mpdclient = nmpd.Mpd(executor, configstate, connstatus)
+        loop_thread = None
+        if cfg.mpd_backend() == 'asyncio':
+            loop_thread = thread.AsyncioLoopThread(log_errors)
+            loop_thread.start()
+            mpdclient = asyncmpd.AsyncMpdAdapter(executor, configstate,
+                                                 connstatus, loop_thread)
+        else:
+            mpdclient = nmpd.Mpd(executor, configstate, connstatus)
         hb_interval = cfg.mpd_hb_interval()
         hb = nmpd.MpdHeartbeat(mpdclient, hb_interval, executor, connstatus)
-        art_cache = artcache.ArtCache(configstate, executor)
+        art_sources = artcache.art_sources(cfg.art_sources(), configstate,
+                                           mpdclient)
+        art_cache = artcache.ArtCache(configstate, executor, art_sources,
+                                      cfg.art_cache_bytes())
 
         main_window = app.App(
             rng,
@@ -106,6 +117,8 @@ def main(args=None):
         connect()
         Gtk.main()
         hb.stop()
+        if loop_thread is not None:
+            loop_thread.stop()
         cfg.set_connected(connstatus.is_connected())
         cfg.save(config.main_config_file())
         logging.shutdown()
@@ -70,11 +70,18 @@ class Album:
     def __hash__(self):
         return hash(self.dirpath)
 
+    def has_songs(self):
+        """
+        Albums can be created from catalog data alone, in which case
+        their songs are loaded later on.
+        """
+        return self.songs is not None
+
     def is_compilation(self):
         return any(s.is_compilation_track for s in self.songs)
 
     def sorted_songs(self):
-        return sorted(self.songs, key=Song.sort_key)
+        return sorted(self.songs or [], key=Song.sort_key)
 
 
 class Song:
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+from functools import partial
+
+import mpd as mpd2
+from mpd.asyncio import MPDClient
+
+from ..util.thread import on_main_when_done
+from .mpdlib import Mpd
+
+
+class AsyncMpd:
+    """
+    A client for the MPD server built on python-mpd2's asyncio
+    client. Its methods are coroutines that run on an
+    AsyncioLoopThread; use submit() to run one from another thread
+    and get a concurrent.futures.Future for its result, or to have
+    the result given to a callback on the GTK main thread.
+
+    python-mpd2 still sends the commands on the connection one at a
+    time. What this saves is waiting: the connection is its own, so
+    its commands don't queue up behind those sent on the executor.
+    """
+
+    def __init__(self, loop_thread):
+        self._loop_thread = loop_thread
+        self._client = MPDClient()
+        self._host = None
+        self._port = None
+        self._connecting = None
+
+    def submit(self, coro, callback=None, error_handler=None):
+        """
+        Runs the coroutine and returns a Future for its result. If a
+        callback is given, it is called with the result on the GTK
+        main thread, and the error handler with any exception.
+        """
+        future = self._loop_thread.submit(coro)
+        if callback is not None:
+            on_main_when_done(future, callback, error_handler)
+        return future
+
+    def set_server(self, host, port):
+        self._host = host
+        self._port = port
+
+    async def _ready(self):
+        """Connects on first use, and waits for that to finish."""
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(
+                self._client.connect(self._host, self._port))
+        connecting = self._connecting
+        try:
+            await connecting
+        except BaseException:
+            # Not kept, so that the next command tries again.
+            if self._connecting is connecting:
+                self._connecting = None
+            raise
+        return self._client
+
+    async def disconnect(self):
+        if self._connecting is not None:
+            self._connecting = None
+            self._client.disconnect()
+
+    async def command(self, name, *args):
+        client = await self._ready()
+        try:
+            return await getattr(client, name)(*args)
+        except (mpd2.ConnectionError, OSError):
+            await self.disconnect()
+            raise
+
+    async def status(self):
+        return await self.command('status')
+
+    async def currentsong(self):
+        record = await self.command('currentsong')
+        # As in Mpd.currentsong, a song with several file entries is
+        # a glitch that clears up if asked again.
+        while isinstance(record.get('file', []), list):
+            record = await self.command('currentsong')
+        return record
+
+    async def playlistinfo(self):
+        return await self.command('playlistinfo')
+
+    async def toggle_pause(self, should_pause):
+        if should_pause:
+            await self.command('pause', 1)
+            return
+        mpdstatus = await self.status()
+        if 'pause' == mpdstatus.get('state', 'stop'):
+            await self.command('pause', 0)
+        else:
+            await self.command('play', 0)
+
+
+class AsyncMpdAdapter(Mpd):
+    """
+    Provides the callback API of Mpd, but sends status queries and
+    player commands through an AsyncMpd, so they don't queue up on
+    the executor behind slow work such as library syncs. As with Mpd,
+    the callbacks are called on the executor thread; MpdHeartbeat
+    relies on that.
+
+    If the async connection fails, the reconnect is handled as for
+    the blocking client; queries are sent again once reconnected.
+
+    Commands that edit the queue, batches, the local library and the
+    play queue copy still use the blocking client that Mpd manages,
+    so that queue edits keep their order. Player commands are sent
+    once the edits queued before them are done, so that e.g. playing
+    after replacing the queue plays the new queue.
+    """
+
+    def __init__(self, scheduled_executor, configstate, connstatus,
+                 loop_thread):
+        super(AsyncMpdAdapter, self).__init__(scheduled_executor,
+                                              configstate, connstatus)
+        self._async = AsyncMpd(loop_thread)
+
+    def _deliver(self, coro_fn, args=(), callback=None):
+        """
+        Runs the coroutine function and gives the result to the
+        callback on the executor thread. Commands with a callback are
+        queries, which are sent again after a lost connection.
+        """
+        future = self._async.submit(coro_fn(*args))
+
+        def on_done(f):
+            if f.cancelled():
+                return
+            e = f.exception()
+            if isinstance(e, (mpd2.ConnectionError, OSError)):
+                retry = partial(self._deliver, coro_fn, args, callback)
+                self.exec(partial(self._on_connection_lost, e, retry,
+                                  callback is not None))
+            elif e is not None:
+                logging.error(f'async command failed: {e}')
+            elif callback is not None:
+                self.exec(partial(callback, f.result()))
+
+        future.add_done_callback(on_done)
+        return future
+
+    def _deliver_after_queued(self, coro_fn, *args):
+        self.exec(lambda: self._deliver(coro_fn, args))
+
+    def connect(self):
+        self._async.set_server(self._host, self._port)
+        super(AsyncMpdAdapter, self).connect()
+
+    def _on_connected(self):
+        # After a reconnect the async connection may be stale too;
+        # dropping it makes the next command open a fresh one.
+        self._async.submit(self._async.disconnect())
+
+    def disconnect(self):
+        self._async.submit(self._async.disconnect())
+        super(AsyncMpdAdapter, self).disconnect()
+
+    def status(self, callback):
+        if not self._connstatus.is_connected():
+            callback({})
+            return
+        self._deliver(self._async.status, (), callback)
+
+    def currentsong(self, callback):
+        self._deliver(self._async.currentsong, (), callback)
+
+    def playlistinfo(self, callback):
+        if not self._connstatus.is_connected():
+            callback([])
+            return
+        self._deliver(self._async.playlistinfo, (), callback)
+
+    def toggle_pause(self, should_pause):
+        self._deliver_after_queued(self._async.toggle_pause, should_pause)
+
+    def toggle_play_mode(self, name, active):
+        self._deliver_after_queued(self._async.command, name,
+                                   1 if active else 0)
+
+    def stop_playing(self):
+        self._deliver_after_queued(self._async.command, 'stop')
+
+    def next_song(self):
+        self._deliver_after_queued(self._async.command, 'next')
+
+    def prev_song(self):
+        self._deliver_after_queued(self._async.command, 'previous')
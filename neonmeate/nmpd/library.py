@@ -0,0 +1,336 @@
+import logging
+import os
+import re
+import sqlite3
+from collections import deque
+
+from ..model import Artist
+
+
+def first_value(value):
+    """Tags that occur more than once in a song come back as lists."""
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def leading_int(value, default):
+    """Parses values like '3/12' for tracks and '1999-05-01' for dates."""
+    m = re.match(r'\s*(\d+)', str(first_value(value) or ''))
+    return int(m.group(1)) if m else default
+
+
+class Library:
+    """
+    A local copy of the server's song database, stored in SQLite.
+    Browsing artists and albums reads from here instead of querying
+    the server, which makes it instant and lets it work while
+    disconnected.
+
+    The copy is filled by a LibrarySync, which walks the server's
+    directories, and after that it is only refreshed when the
+    server's stats report a new db_update time. When that happens,
+    only the directories whose contents differ from the copy are
+    rewritten.
+
+    Instances are not thread safe; they are meant to be used only
+    from the executor thread that talks to the server.
+    """
+
+    Schema = [
+        '''CREATE TABLE IF NOT EXISTS songs (
+               file TEXT PRIMARY KEY,
+               dir TEXT NOT NULL,
+               artist TEXT,
+               albumartist TEXT,
+               album TEXT,
+               title TEXT,
+               track INTEGER,
+               disc INTEGER,
+               date INTEGER,
+               duration REAL)''',
+        'CREATE INDEX IF NOT EXISTS songs_albumartist ON songs(albumartist)',
+        'CREATE INDEX IF NOT EXISTS songs_artist ON songs(artist)',
+        'CREATE INDEX IF NOT EXISTS songs_album ON songs(album)',
+        'CREATE INDEX IF NOT EXISTS songs_dir ON songs(dir)',
+        '''CREATE TABLE IF NOT EXISTS song_artists (
+               file TEXT NOT NULL,
+               dir TEXT NOT NULL,
+               role TEXT NOT NULL,
+               name TEXT NOT NULL)''',
+        'CREATE INDEX IF NOT EXISTS song_artists_name ON song_artists(name)',
+        'CREATE INDEX IF NOT EXISTS song_artists_dir ON song_artists(dir)',
+        '''CREATE TABLE IF NOT EXISTS dirs (
+               dir TEXT PRIMARY KEY,
+               signature TEXT NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS meta (
+               key TEXT PRIMARY KEY,
+               value TEXT)'''
+    ]
+
+    # Copies made with an older schema are synced again from scratch.
+    SchemaVersion = '2'
+
+    # Songs can have several of these tags; every value is kept in
+    # song_artists, while the songs table holds the first.
+    ArtistRoles = ['albumartist', 'artist']
+
+    SongColumns = ['file', 'dir', 'artist', 'albumartist', 'album', 'title',
+                   'track', 'disc', 'date', 'duration']
+
+    def __init__(self, db_path):
+        self._db_path = db_path
+        self._conn = None
+        self._log = logging.getLogger(__name__)
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self._db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self._db_path)
+            with self._conn:
+                for statement in Library.Schema:
+                    self._conn.execute(statement)
+                self._check_schema_version()
+        return self._conn
+
+    def _check_schema_version(self):
+        db = self._conn
+        row = db.execute(
+            "SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if row is not None and row[0] == Library.SchemaVersion:
+            return
+        for table in ['songs', 'song_artists', 'dirs', 'meta']:
+            db.execute(f'DELETE FROM {table}')
+        db.execute("INSERT INTO meta (key, value) VALUES ('schema', ?)",
+                   (Library.SchemaVersion,))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def is_populated(self):
+        return self.db_update() is not None
+
+    def db_update(self):
+        row = self._db().execute(
+            "SELECT value FROM meta WHERE key = 'db_update'").fetchone()
+        return row[0] if row else None
+
+    def needs_sync(self, stamp):
+        """
+        Whether the copy is behind the server whose stats reported
+        the db_update stamp. A server that reports no stamp can't be
+        told apart from an unchanged one, so it is only synced once.
+        """
+        if stamp is None:
+            return not self.is_populated()
+        return stamp != self.db_update()
+
+    @staticmethod
+    def signature(mtime, songs):
+        # A directory's own mtime doesn't change when a file in it is
+        # retagged, so the songs' mtimes are part of the signature.
+        newest = max((s.get('last-modified', '') for s in songs),
+                     default='')
+        return f'{mtime}|{newest}|{len(songs)}'
+
+    def update_directories(self, listings):
+        """
+        Rewrites the directories, given as (directory, signature,
+        songs) tuples, whose signature differs from the stored one.
+        Returns how many were rewritten.
+        """
+        db = self._db()
+        changed = []
+        for d, signature, songs in listings:
+            row = db.execute('SELECT signature FROM dirs WHERE dir = ?',
+                             (d,)).fetchone()
+            if row is None or row[0] != signature:
+                changed.append((d, signature, songs))
+
+        with db:
+            for d, signature, songs in changed:
+                Library._delete_directory(db, d)
+                db.executemany(
+                    f'INSERT OR REPLACE INTO songs '
+                    f'({", ".join(Library.SongColumns)}) '
+                    f'VALUES ({", ".join("?" * len(Library.SongColumns))})',
+                    [Library._song_row(d, s) for s in songs]
+                )
+                db.executemany(
+                    'INSERT INTO song_artists (file, dir, role, name) '
+                    'VALUES (?, ?, ?, ?)',
+                    [row for s in songs for row in Library._artist_rows(d, s)]
+                )
+                db.execute('INSERT INTO dirs (dir, signature) VALUES (?, ?)',
+                           (d, signature))
+        return len(changed)
+
+    def finish_sync(self, directories, stamp):
+        """
+        Removes the directories that are not among those the server
+        listed, and records the stamp the copy is now up to date
+        with. Returns how many directories were removed.
+        """
+        db = self._db()
+        removed = [d for (d,) in db.execute('SELECT dir FROM dirs')
+                   if d not in directories]
+        with db:
+            for d in removed:
+                Library._delete_directory(db, d)
+            # An empty stamp still marks the copy as populated.
+            db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) "
+                "VALUES ('db_update', ?)", (stamp or '',))
+        return len(removed)
+
+    @staticmethod
+    def _delete_directory(db, directory):
+        for table in ['songs', 'song_artists', 'dirs']:
+            db.execute(f'DELETE FROM {table} WHERE dir = ?', (directory,))
+
+    @staticmethod
+    def _artist_rows(directory, song):
+        for role in Library.ArtistRoles:
+            value = song.get(role, None)
+            names = value if isinstance(value, list) else [value]
+            for name in dict.fromkeys(names):
+                if name:
+                    yield song['file'], directory, role, name
+
+    @staticmethod
+    def _song_row(directory, song):
+        return (
+            song['file'],
+            directory,
+            first_value(song.get('artist', None)),
+            first_value(song.get('albumartist', None)),
+            first_value(song.get('album', None)),
+            first_value(song.get('title', os.path.basename(song['file']))),
+            leading_int(song.get('track', None), 0),
+            leading_int(song.get('disc', None), 1),
+            leading_int(song.get('date', None), 0),
+            float(song.get('duration', song.get('time', 0)))
+        )
+
+    def artists(self):
+        """Returns all artists and album artists, sorted by name."""
+        db = self._db()
+        artists = set()
+        for key in Library.ArtistRoles:
+            for (name,) in db.execute(
+                    'SELECT DISTINCT name FROM song_artists WHERE role = ?',
+                    (key,)):
+                artist = Artist.create({key: name})
+                if artist:
+                    artists.add(artist)
+        return sorted(list(artists))
+
+    def files(self):
+        """Yields the URI of every song in the library."""
+        for (file,) in self._db().execute('SELECT file FROM songs'):
+            yield file
+
+    def albums_by_artist(self, name):
+        """
+        Returns (title, date, directory) for each album the artist
+        appears on, without reading the albums' songs.
+        """
+        return list(self._db().execute(
+            'SELECT album, MIN(date), dir FROM songs '
+            'WHERE file IN (SELECT file FROM song_artists WHERE name = ?) '
+            'AND album IS NOT NULL '
+            'GROUP BY album, dir',
+            (name,)
+        ))
+
+    def all_albums(self):
+        """
+        Returns (artist, title, date, directory) for every album in
+        the library. The artist is the album artist where there is
+        one.
+        """
+        return list(self._db().execute(
+            'SELECT COALESCE(MIN(albumartist), MIN(artist)), album, '
+            'MIN(date), dir FROM songs '
+            'WHERE album IS NOT NULL '
+            'GROUP BY album, dir'
+        ))
+
+    def songs_in_album(self, title, directory):
+        """
+        Returns the songs of an album, as dicts shaped like the song
+        records the server sends.
+        """
+        cursor = self._db().execute(
+            f'SELECT {", ".join(Library.SongColumns)} FROM songs '
+            f'WHERE album = ? AND dir = ? ORDER BY file',
+            (title, directory)
+        )
+        return [Library._song_record(row) for row in cursor]
+
+    @staticmethod
+    def _song_record(row):
+        record = dict(zip(Library.SongColumns, row))
+        del record['dir']
+        return record
+
+
+class LibrarySync:
+    """
+    Brings a Library up to date by walking the server's directories
+    with lsinfo, a batch of directories per step. Only the listings
+    of one batch are held at a time, and the caller can send other
+    commands between steps, so a large library doesn't hold up the
+    connection for the whole sync.
+
+    Like the Library, this is meant to be used only from the executor
+    thread that talks to the server.
+    """
+
+    BatchSize = 32
+
+    def __init__(self, library, stamp):
+        self.library = library
+        self.stamp = stamp
+        self._pending = deque([''])
+        self._mtimes = {}
+        self._seen = set()
+        self._changed = 0
+        self._log = logging.getLogger(__name__)
+
+    def done(self):
+        return not self._pending
+
+    def step(self, run_batch):
+        """
+        Lists the next batch of directories. run_batch is given the
+        lsinfo commands and returns a BatchResult for them. After the
+        last step, the directories the server no longer has are
+        removed from the library.
+        """
+        count = min(LibrarySync.BatchSize, len(self._pending))
+        dirs = [self._pending.popleft() for _ in range(count)]
+        result = run_batch([('lsinfo', d) for d in dirs])
+        listings = []
+        for d, records in zip(dirs, result.replies):
+            mtime = self._mtimes.pop(d, '')
+            if records is None:
+                # Removed since its parent was listed.
+                continue
+            songs = []
+            for record in records:
+                if 'directory' in record:
+                    sub = record['directory']
+                    self._mtimes[sub] = record.get('last-modified', '')
+                    self._pending.append(sub)
+                elif 'file' in record:
+                    songs.append(record)
+            self._seen.add(d)
+            listings.append((d, Library.signature(mtime, songs), songs))
+        self._changed += self.library.update_directories(listings)
+        if self.done():
+            removed = self.library.finish_sync(self._seen, self.stamp)
+            self._log.info(f'library sync rewrote {self._changed} and '
+                           f'removed {removed} directories')
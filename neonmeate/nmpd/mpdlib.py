@@ -3,10 +3,19 @@ import logging
 import os
 import random
 import re
+import select
+import threading
+import time
+import types
 
 import mpd as mpd2
 from gi.repository import GObject
 from ..model import Album, Artist, Song
+from ..ui.toolkit import glib_main
+from ..util.config import neonmeate_cache_dir
+from .library import Library, LibrarySync, leading_int
+from .playqueue import PlayQueue
+from .sampler import SongSampler
 from functools import partial
 import neonmeate.util.thread as thread
 
@@ -23,13 +32,39 @@ class MpdConnectionStatus(GObject.GObject):
         self._connected = False
 
     def set_connected(self, connected):
+        """
+        Records whether we are connected. This may be called from
+        any thread; the signal is always emitted on the main thread.
+        """
         self._connected = connected
+        self._emit_connected(connected)
+
+    @glib_main
+    def _emit_connected(self, connected):
         self.emit(MpdConnectionStatus.SIG_MPD_CONNECTED, connected)
 
     def is_connected(self):
         return self._connected
 
 
+class BatchResult:
+    """
+    The outcome of a batch of commands. Replies and errors are
+    indexed by the position of the command within the batch. A
+    command that failed has a reply of None and an entry in errors.
+    """
+
+    def __init__(self, size):
+        self.replies = [None] * size
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.replies)
+
+    def succeeded(self):
+        return not self.errors
+
+
 class Mpd:
     """
     Our client for interacting with the MPD server. The commands are
@@ -39,6 +74,20 @@ class Mpd:
 
     """
 
+    # The server rejects command lists larger than its configured
+    # max_command_list_size (2 MiB by default), so batches are split
+    # into chunks that stay comfortably below that.
+    BatchMaxCommands = 1000
+    BatchMaxBytes = 512 * 1024
+
+    # Reconnection attempts start quickly and back off to this limit.
+    ReconnectMinSecs = 0.5
+    ReconnectMaxSecs = 30
+
+    # Queries that failed while the connection was down, kept to be
+    # sent again once it is back.
+    MaxReplay = 100
+
     def __init__(self, scheduled_executor, configstate, connstatus):
         self._exec = scheduled_executor
         host, port = configstate.get_host_and_port()
@@ -51,10 +100,34 @@ class Mpd:
         self._client.timeout = 10
         self._client.idletimeout = None
         self._status = {}
+        self._play_queue = PlayQueue()
+        self._library = Mpd._library_for(host, port)
+        self._library_sync = None
+        self._library_waiting = []
+        self._sampler = SongSampler()
+        self._waiting_lock = threading.Lock()
+        self._waiting_callbacks = {}
+        self._wants_connection = False
+        self._connect_attempts = 0
+        self._backoff = Mpd.ReconnectMinSecs
+        self._reconnect = None
+        self._replay = []
+
+    @staticmethod
+    def _library_for(host, port):
+        filename = f'library-{host}-{port}.sqlite'.replace(os.sep, '_')
+        return Library(os.path.join(neonmeate_cache_dir(), filename))
 
     def _on_host_chg(self, state, _):
         self.disconnect()
         self._host, self._port = self._configstate.get_host_and_port()
+        library = Mpd._library_for(self._host, self._port)
+
+        def switch_library():
+            self._library.close()
+            self._library = library
+
+        self.exec(switch_library)
         self.connect()
 
     def set_host(self, host):
@@ -63,30 +136,228 @@ class Mpd:
     def set_port(self, port):
         self._port = port
 
-    def exec(self, runnable):
-        self._exec.execute(runnable)
+    def exec(self, runnable, key=None, replayable=False):
+        """
+        Queues the runnable on the executor. If it fails because the
+        connection to the server is down, a reconnect is scheduled.
+        Replayable runnables are those that can safely run twice,
+        like queries; they are run again once we reconnect. Anything
+        else is dropped, since e.g. adding songs twice would be worse
+        than not adding them.
+        """
+
+        def task():
+            try:
+                runnable()
+            except (mpd2.ConnectionError, OSError) as e:
+                self._on_connection_lost(e, runnable, replayable)
+
+        self._exec.execute(task, key)
+
+    def _exec_query(self, key, query, callback):
+        """
+        Queues a query whose result is given to the callback. While
+        the query is still waiting to be sent, asking for it again
+        doesn't queue it a second time; the one result is given to
+        every callback that asked for it.
+        """
+        with self._waiting_lock:
+            self._waiting_callbacks.setdefault(key, []).append(callback)
+
+        def task():
+            with self._waiting_lock:
+                callbacks = self._waiting_callbacks.pop(key, [])
+            if not callbacks:
+                return
+            try:
+                result = query()
+            except (mpd2.ConnectionError, OSError):
+                # Put them back for when the query is replayed.
+                with self._waiting_lock:
+                    waiting = self._waiting_callbacks.setdefault(key, [])
+                    waiting[:0] = callbacks
+                raise
+            for cb in callbacks:
+                cb(result)
+
+        self.exec(task, key, replayable=True)
+
+    def create_connection(self):
+        """
+        Opens a new connection to the server, separate from the one
+        used for commands. This is for work that would otherwise tie
+        up the command connection, such as blocking on idle.
+        """
+        client = mpd2.MPDClient()
+        client.timeout = self._client.timeout
+        client.idletimeout = None
+        client.connect(self._host, self._port)
+        return client
+
+    def host_and_port(self):
+        """The server that connections are currently made to."""
+        return self._host, self._port
+
+    def batch(self, commands, callback=None):
+        """
+        Sends many commands using as few round trips as possible.
+        Each command is a tuple of the command name followed by its
+        arguments, e.g. ('add', 'some/file.flac'). A BatchResult is
+        given to the callback, if one is supplied.
+        """
+
+        def task():
+            result = self._run_batch(commands)
+            if callback is not None:
+                callback(result)
+
+        self.exec(task)
+
+    def _run_batch(self, commands):
+        """
+        Runs the commands as command lists on the calling thread,
+        which must be the executor thread. A failing command does not
+        prevent the rest of the batch from being sent.
+        """
+        result = BatchResult(len(commands))
+        for start, end in Mpd._batch_chunks(commands):
+            self._run_command_list(commands, start, end, result)
+        for index, error in result.errors.items():
+            logging.error(f'batched command {commands[index][0]} failed: '
+                          f'{error}')
+        return result
+
+    def _run_command_list(self, commands, start, end, result):
+        while start < end:
+            self._client.command_list_ok_begin()
+            for name, *args in commands[start:end]:
+                getattr(self._client, name)(*args)
+            # The replies are read one at a time, so that those of the
+            # commands before a failing one are kept; read all at once,
+            # they would be lost with the error.
+            index = start
+            self._client.iterate = True
+            try:
+                for reply in self._client.command_list_end():
+                    if isinstance(reply, types.GeneratorType):
+                        reply = list(reply)
+                    result.replies[index] = reply
+                    index += 1
+                return
+            except mpd2.CommandError as e:
+                # The server stops at the first failing command; the
+                # ones after it are sent again in a new list.
+                result.errors[index] = e
+                start = index + 1
+            finally:
+                self._client.iterate = False
+
+    @staticmethod
+    def _batch_chunks(commands):
+        """
+        Yields (start, end) index pairs that split the commands into
+        lists small enough for the server to accept.
+        """
+        start = 0
+        size = 0
+        for i, (name, *args) in enumerate(commands):
+            cmd_size = len(name) + sum(len(str(a)) + 3 for a in args) + 1
+            full = i - start >= Mpd.BatchMaxCommands
+            if i > start and (full or size + cmd_size > Mpd.BatchMaxBytes):
+                yield start, i
+                start = i
+                size = 0
+            size += cmd_size
+        if start < len(commands):
+            yield start, len(commands)
 
     def connect(self):
         """
-        Connects to the MPD server, blocking until the server
-        status is obtained.
+        Connects to the MPD server in the background. The connection
+        status is updated when the attempt is done; if it fails, or
+        if the connection is lost later, we keep trying to reconnect
+        until disconnect() is called.
         """
+        self._wants_connection = True
+        self._connect_attempts = 0
+        self._backoff = Mpd.ReconnectMinSecs
+        self.exec(self._try_connect)
+
+    def _try_connect(self):
+        self._cancel_reconnect()
+        if not self._wants_connection or self._connstatus.is_connected():
+            return
+        self._connect_attempts += 1
         try:
+            # Drops whatever is left of a connection that was lost.
+            self._client.disconnect()
             self._client.connect(self._host, self._port)
-            self._connstatus.set_connected(True)
-        except ConnectionError:
-            logging.error('connection refused')
+        except (mpd2.ConnectionError, OSError) as e:
+            logging.error(f'could not connect to {self._host}:{self._port}:'
+                          f' {e}')
+            if self._connect_attempts == 1:
+                self._connstatus.set_connected(False)
+            self._schedule_reconnect()
+            return
+        self._connect_attempts = 0
+        self._backoff = Mpd.ReconnectMinSecs
+        self._play_queue.clear()
+        self._on_connected()
+        self._connstatus.set_connected(True)
+        replay, self._replay = self._replay, []
+        for runnable in replay:
+            self.exec(runnable, replayable=True)
+        self.status(self._set_status)
+
+    def _on_connected(self):
+        """Called on the executor thread after each (re)connection."""
+        pass
+
+    def _set_status(self, s):
+        self._status = s
+
+    def _on_connection_lost(self, e, runnable, replayable):
+        if not self._wants_connection:
+            return
+        if replayable:
+            if len(self._replay) < Mpd.MaxReplay:
+                self._replay.append(runnable)
+        else:
+            logging.warning(f'dropped a command while disconnected: {e}')
+        if self._connstatus.is_connected():
+            logging.error(f'lost connection to the server: {e}')
             self._connstatus.set_connected(False)
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if not self._wants_connection or self._reconnect is not None:
             return
+        delay = self._backoff
+        self._backoff = min(2 * self._backoff, Mpd.ReconnectMaxSecs)
+        logging.info(f'reconnecting in {delay}s')
+        # A timer of its own rather than the executor's scheduler,
+        # whose thread would sleep until the retry was due even after
+        # it was cancelled, holding up the events queued behind it.
+        self._reconnect = threading.Timer(delay, self.exec,
+                                          [self._try_connect])
+        self._reconnect.daemon = True
+        self._reconnect.start()
+
+    def _cancel_reconnect(self):
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
 
-        def set_status(s):
-            self._status = s
+    def disconnect(self):
+        self._wants_connection = False
 
-        self.status(set_status)
+        def task():
+            self._cancel_reconnect()
+            self._replay = []
+            self._client.disconnect()
+            self._connstatus.set_connected(False)
 
-    def disconnect(self):
-        self._client.disconnect()
-        self._connstatus.set_connected(False)
+        self.exec(task)
 
     def close(self):
         """Shuts down the client and disconnects from the server."""
@@ -108,13 +379,13 @@ class Mpd:
     def currentsong(self, callback):
         """Fetches the current song."""
 
-        def task():
+        def query():
             record = self._client.currentsong()
             while isinstance(record.get('file', []), list):
                 record = self._client.currentsong()
-            callback(record)
+            return record
 
-        self.exec(task)
+        self._exec_query('currentsong', query, callback)
 
     def playlistinfo(self, callback):
         """
@@ -126,11 +397,30 @@ class Mpd:
             callback([])
             return
 
-        def task():
-            playqueue = self._client.playlistinfo()
-            callback(playqueue)
+        self._exec_query('playlistinfo', self._client.playlistinfo, callback)
 
-        self.exec(task)
+    def sync_play_queue(self, callback):
+        """
+        Updates the local copy of the play queue and gives the
+        callback a QueueChanges describing what changed, or None if
+        the queue is unchanged since the last sync.
+        """
+        if not self._connstatus.is_connected():
+            callback(None)
+            return
+
+        self._exec_query('sync_play_queue', self._sync_play_queue, callback)
+
+    def _sync_play_queue(self):
+        return self._play_queue.sync(
+            self._client,
+            self._client.status(),
+            self._queue_entries_by_id
+        )
+
+    def _queue_entries_by_id(self, ids):
+        result = self._run_batch([('playlistid', i) for i in ids])
+        return [entries[0] for entries in result.replies if entries]
 
     def stop_playing(self):
         self.exec(self._client.stop)
@@ -153,71 +443,211 @@ class Mpd:
 
         self.status(on_status)
 
-    def find_artists(self, callback):
+    def _sync_library(self, then):
         """
-        Queries the database for all artists. A list of Artist
-        instances will be provided to the callback.
+        Brings the local library up to date if connected, then runs
+        then on the executor. The sync is done a step at a time, each
+        step a task of its own, so that commands queued meanwhile,
+        such as those controlling playback, don't wait for the whole
+        library to be listed. If the server can't be reached, the
+        library is left as it is.
         """
         if not self._connstatus.is_connected():
-            callback([])
+            then()
+            return
+        if self._library_sync is not None:
+            self._library_waiting.append(then)
+            return
+        # A lost connection is left to the caller's task, so that the
+        # reconnect is scheduled and the task replayed if it can be.
+        try:
+            stamp = self._client.stats().get('db_update', None)
+        except mpd2.CommandError as e:
+            logging.error(f'library sync failed: {e}')
+            then()
+            return
+        if not self._library.needs_sync(stamp):
+            then()
+            return
+        logging.info('library changed on the server, syncing')
+        self._library_waiting.append(then)
+        self._library_sync = LibrarySync(self._library, stamp)
+        self.exec(self._step_library_sync, 'library_sync')
+
+    def _step_library_sync(self):
+        sync = self._library_sync
+        if sync is None:
             return
+        if sync.library is not self._library:
+            # The server was switched while syncing.
+            self._finish_library_sync()
+            return
+        try:
+            sync.step(self._run_batch)
+        except (mpd2.ConnectionError, OSError):
+            self._finish_library_sync()
+            raise
+        except mpd2.MPDError as e:
+            logging.error(f'library sync failed: {e}')
+            self._finish_library_sync()
+            return
+        if sync.done():
+            self._finish_library_sync()
+        else:
+            self.exec(self._step_library_sync, 'library_sync')
+
+    def _finish_library_sync(self):
+        self._library_sync = None
+        waiting, self._library_waiting = self._library_waiting, []
+        for then in waiting:
+            self.exec(then)
+
+    def find_artists(self, callback):
+        """
+        Looks up all artists in the local library, syncing it with
+        the server first if it has changed. A list of Artist
+        instances will be provided to the callback.
+        """
 
         def task():
-            artists = set()
-            for a in self._client.list('albumartist'):
-                artist = Artist.create(a)
-                if artist:
-                    artists.add(artist)
-            for a in self._client.list('artist'):
-                artist = Artist.create(a)
-                if artist:
-                    artists.add(artist)
-
-            callback(sorted(list(artists)))
+            self._sync_library(
+                lambda: callback(self._library.artists())
+            )
 
-        self.exec(task)
+        self.exec(task, replayable=True)
 
     def find_albums(self, artist, callback):
+        """
+        Looks up the artist's albums. A list of Album instances,
+        oldest first, will be provided to the callback. Only the
+        albums' catalog data is read; their songs can be loaded
+        afterwards with load_album_songs().
+        """
+
         def task():
-            songs_by_album = {}
-            dirs_by_album = {}
-            songs = set()
-            Mpd._process_songs(
-                self._client.find('albumartist', artist.name),
-                songs_by_album, dirs_by_album, songs
-            )
+            if self._library.is_populated():
+                rows = self._library.albums_by_artist(artist.name)
+            else:
+                rows = self._album_catalog(artist.name)
+            albums = [Album(artist, title, date, None, dirpath)
+                      for title, date, dirpath in rows]
+            callback(Album.sorted_chrono(albums))
 
-            Mpd._process_songs(
-                self._client.find('artist', artist.name),
-                songs_by_album, dirs_by_album, songs
-            )
+        self.exec(task, replayable=True)
+
+    def find_all_albums(self, callback):
+        """
+        Looks up every album in the library. A list of Album
+        instances, oldest first, will be provided to the callback.
+        """
 
+        def task():
+            if self._library.is_populated():
+                rows = self._library.all_albums()
+            else:
+                rows = self._album_catalog(None)
             albums = []
+            for name, title, date, dirpath in rows:
+                artist = Artist.create({'albumartist': name})
+                albums.append(Album(artist, title, date, None, dirpath))
+            callback(Album.sorted_chrono(albums))
 
-            for key, songs in songs_by_album.items():
-                a = Album(artist, key[0], key[1], songs, dirs_by_album[key][0])
-                albums.append(a)
+        self.exec(task, replayable=True)
 
-            ordered_albums = Album.sorted_chrono(albums)
-            callback(ordered_albums)
+    def _album_catalog(self, artist_name):
+        """
+        Asks the server for albums without downloading their songs,
+        for when the local library is not available. If artist_name
+        is None, all albums are listed. Returns (title, date,
+        directory) tuples, with the album artist prepended when
+        listing all albums.
+        """
+        keys = set()
+        if artist_name is None:
+            for rec in self._client.list('album', 'group', 'albumartist'):
+                for title in Mpd._as_list(rec.get('album', [])):
+                    keys.add(('albumartist', rec.get('albumartist', ''),
+                              title, None))
+        else:
+            for tag in ['albumartist', 'artist']:
+                expr = Mpd._filter(tag, artist_name)
+                for rec in self._client.list('album', expr, 'group', 'date'):
+                    for title in Mpd._as_list(rec.get('album', [])):
+                        keys.add((tag, artist_name, title, rec.get('date', '')))
+        keys = [k for k in keys if k[1] and k[2]]
+
+        # One song from each album is enough to know its directory.
+        queries = []
+        for tag, name, title, date in keys:
+            tags_and_values = [(tag, name), ('album', title)]
+            if date is not None:
+                tags_and_values.append(('date', date))
+            queries.append(('find', Mpd._filter_all(tags_and_values),
+                            'window', (0, 1)))
+        replies = self._run_batch(queries).replies
+        rows = {}
+        for (_, name, title, date), found in zip(keys, replies):
+            if not found:
+                continue
+            dirpath = os.path.dirname(found[0]['file'])
+            year = leading_int(found[0].get('date', date), 0)
+            row = (title, year, dirpath)
+            rows[(title, dirpath)] = row if artist_name else (name,) + row
+        return list(rows.values())
+
+    def load_album_songs(self, album, callback):
+        """
+        Fills in the songs of an album that was created from catalog
+        data. The album is given to the callback once it has its
+        songs.
+        """
+        if album.has_songs():
+            callback(album)
+            return
 
-        self.exec(task)
+        def task():
+            self._load_album_songs(album)
+            callback(album)
+
+        self.exec(task, replayable=True)
+
+    def _load_album_songs(self, album):
+        if album.has_songs():
+            return
+        if self._library.is_populated():
+            records = self._library.songs_in_album(album.title, album.dirpath)
+        else:
+            records = self._client.find(Mpd._filter_all([
+                ('base', album.dirpath), ('album', album.title)]))
+        songs = []
+        for record in records:
+            song = Song.create(record)
+            if song not in songs:
+                songs.append(song)
+        album.songs = songs
+
+    @staticmethod
+    def _as_list(value):
+        return value if isinstance(value, list) else [value]
+
+    @staticmethod
+    def _quote(value):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        return f'"{escaped}"'
+
+    @staticmethod
+    def _filter(tag, value):
+        """Builds an MPD filter expression matching a tag value."""
+        if tag == 'base':
+            return f'(base {Mpd._quote(value)})'
+        return f'({tag} == {Mpd._quote(value)})'
 
     @staticmethod
-    def _process_songs(songs, songs_by_album, dirs_by_album, songset):
-        for song in songs:
-            if 'album' in song:
-                album_name = song['album']
-                date = int(song['date'])
-                directory = os.path.dirname(song['file'])
-                key = (album_name, date, directory)
-                songlist = songs_by_album.setdefault(key, [])
-                dirs = dirs_by_album.setdefault(key, [])
-                dirs.append(directory)
-                s = Song.create(song)
-                if s not in songset:
-                    songlist.append(s)
-                    songset.add(s)
+    def _filter_all(tags_and_values):
+        exprs = [Mpd._filter(tag, value) for tag, value in tags_and_values]
+        if len(exprs) == 1:
+            return exprs[0]
+        return f'({" AND ".join(exprs)})'
 
     def add_random(self, item_type, n):
         if item_type == 'Songs':
@@ -240,14 +670,9 @@ class Mpd:
                         pairs.append((art, i))
                 else:
                     pairs.append((art, alb))
-            all_files = []
             selected = random.choices(pairs, k=n)
-            for artist, album in selected:
-                files = [r['file'] for r in
-                         self._client.list('file', 'albumartist', artist,
-                                           'album', album)]
-                all_files.extend(files)
-            self.add_files_to_playlist(all_files)
+            self._add_albums([[('albumartist', artist), ('album', album)]
+                              for artist, album in selected])
 
         self.exec(task)
 
@@ -265,22 +690,50 @@ class Mpd:
             add_all('artist')
             l = list(artists)
             selected = random.choices(l, k=n)
-            files = []
-            for sel in selected:
-                files.extend([r['file'] for r in
-                              self._client.list('file', 'artist', sel)])
-            self.add_files_to_playlist(files)
+            self._run_batch([('findadd', Mpd._filter('artist', sel))
+                             for sel in selected])
 
         self.exec(task)
 
     def _add_random_songs(self, count):
         def task():
-            allsongs = [r for r in self._client.listall() if 'file' in r]
-            selected = [r['file'] for r in random.choices(allsongs, k=count)]
-            self.add_files_to_playlist(selected)
+            self._refresh_sampler(
+                lambda: self._add_files(self._sampler.sample(count))
+            )
 
         self.exec(task)
 
+    def refresh_library(self):
+        """
+        Brings the local library and the random song sampler up to
+        date after the server's database has changed.
+        """
+        self.exec(self._refresh_sampler)
+
+    def _refresh_sampler(self, then=None):
+        """
+        Rebuilds the sampler's song list if the server's database has
+        changed since it was built, then runs then if given. The list
+        comes from the local library when it is up to date, and from
+        the server otherwise.
+        """
+
+        def refresh():
+            if self._library.is_populated():
+                stamp = self._library.db_update()
+                if self._sampler.is_stale(stamp):
+                    self._sampler.refresh(self._library.files(), stamp)
+            else:
+                stamp = self._client.stats().get('db_update', None)
+                if self._sampler.is_stale(stamp):
+                    records = self._client.list('file')
+                    self._sampler.refresh((r['file'] for r in records),
+                                          stamp)
+            if then is not None:
+                then()
+
+        self._sync_library(refresh)
+
     def add_songs(self, songs):
         files = [song.file for song in songs]
         self.add_files_to_playlist(files)
@@ -291,43 +744,78 @@ class Mpd:
     def add_album_to_playlist(self, album):
         """
         Appends an album to the queue.
-        :param album: an Album instance containing the songs to add.
+        :param album: an Album instance; its songs need not be loaded.
         """
-        files = [song.file for song in album.sorted_songs()]
-        self.add_files_to_playlist(files)
 
-    def add_files_to_playlist(self, files):
         def task():
-            for file in files:
-                self._client.add(file)
+            self._add_albums([[('base', album.dirpath),
+                               ('album', album.title)]])
 
         self.exec(task)
 
-    def remove_album_from_playlist(self, album):
-        files = set(s.file for s in album.sorted_songs())
-        self.remove_files_from_playlist(files)
+    def _add_albums(self, albums):
+        """
+        Appends albums to the queue without sending their files back
+        and forth. Each album is given as a list of (tag, value) pairs
+        that identify its songs. This takes two round trips however
+        many albums there are: one to learn each album's discs, and
+        one to findadd each disc with its songs sorted by track, which
+        is the same order as Album.sorted_songs().
+        """
+        disc_queries = [('list', 'disc', Mpd._filter_all(tags_and_values))
+                        for tags_and_values in albums]
+        disc_replies = self._run_batch(disc_queries).replies
+        adds = []
+        for tags_and_values, records in zip(albums, disc_replies):
+            discs = {r.get('disc', '') for r in records or []}
+            # Songs without a disc number sort as disc 1.
+            ordered = sorted(discs, key=lambda d: (leading_int(d, 1), d))
+            for disc in ordered or [None]:
+                disc_filter = [] if disc is None else [('disc', disc)]
+                expr = Mpd._filter_all(tags_and_values + disc_filter)
+                adds.append(('findadd', expr, 'sort', 'track'))
+        result = self._run_batch(adds)
+
+        # Servers older than 0.23 don't accept sort with findadd.
+        unsorted = [adds[i][:2] for i in sorted(result.errors)]
+        if unsorted:
+            self._run_batch(unsorted)
 
-    def remove_files_from_playlist(self, files):
+    def add_files_to_playlist(self, files):
+        def task():
+            self._add_files(files)
+
+        self.exec(task)
 
-        def removal_task(playlist):
-            for t in playlist:
-                if t['file'] in files:
-                    self._client.deleteid(t['id'])
+    def _add_files(self, files):
+        return self._run_batch([('add', file) for file in files])
 
-        def on_playlist(playlist):
-            self.exec(removal_task(playlist))
+    def remove_album_from_playlist(self, album):
+        def task():
+            self._load_album_songs(album)
+            self._remove_files(set(s.file for s in album.sorted_songs()))
 
-        self.playlistinfo(on_playlist)
+        self.exec(task)
+
+    def remove_files_from_playlist(self, files):
+        self.exec(lambda: self._remove_files(files))
+
+    def _remove_files(self, files):
+        # The ids are looked up on the server rather than by syncing
+        # the local copy of the queue; that copy is only synced when
+        # the playlist idle event comes in, so that the App gets the
+        # changes.
+        found = self._run_batch([('playlistfind', 'file', f) for f in files])
+        ids = [e['id'] for entries in found.replies if entries
+               for e in entries]
+        self._run_batch([('deleteid', i) for i in ids])
 
     def status(self, callback):
         if not self._connstatus.is_connected():
             callback({})
             return
 
-        def task():
-            callback(self._client.status())
-
-        self.exec(task)
+        self._exec_query('status', self._client.status, callback)
 
     def clear_playlist(self):
         def task():
@@ -336,11 +824,23 @@ class Mpd:
         self.exec(task)
 
     def crop_playlist(self):
+        """
+        Removes everything from the queue except the current song,
+        or except the first song if nothing is playing.
+        """
+
         def task():
-            q = self._client.playlistinfo()
-            n = len(q)
-            if n > 1:
-                self._client.delete((1, n))
+            mpdstatus = self._client.status()
+            n = int(mpdstatus.get('playlistlength', 0))
+            pos = int(mpdstatus.get('song', 0))
+            deletions = []
+            # Delete the later range first so positions stay valid.
+            if pos + 1 < n:
+                deletions.append(('delete', (pos + 1, n)))
+            if pos > 0:
+                deletions.append(('delete', (0, pos)))
+            self._run_batch(deletions)
+
         self.exec(task)
 
     def shuffle_playlist(self):
@@ -423,6 +923,15 @@ class MpdState(GObject.GObject):
         updating = status.get('updating_db', '0')
         self._update_if_changed('updatingdb', updating)
 
+    def advance_elapsed(self, seconds):
+        """
+        Moves the elapsed time forward from what was last reported
+        by the server, without going past the end of the song.
+        """
+        elapsed_secs = float(self.get_property('elapsed')) + seconds
+        total_secs = self.get_property('songseconds')
+        self._update_if_changed('elapsedseconds', min(elapsed_secs, total_secs))
+
     def _update_elapsed_time(self):
         elapsed_secs = float(self.get_property('elapsed'))
         duration_str = self.get_property('duration')
@@ -432,14 +941,82 @@ class MpdState(GObject.GObject):
             self._update_if_changed('elapsedseconds', elapsed_secs)
 
 
+class MpdIdleListener(threading.Thread):
+    """
+    Holds a dedicated connection to the server that blocks on the
+    idle command. Whenever the server reports that subsystems have
+    changed, their names are given to the on_changes callback. This
+    runs on its own thread so that the command connection is never
+    tied up waiting for changes. The on_unsupported and on_error
+    callbacks are given the listener that failed.
+    """
+
+    Subsystems = ['player', 'playlist', 'database', 'options', 'update']
+
+    def __init__(self, connection_factory, on_changes, on_unsupported,
+                 on_error, wakeup_secs=1.0):
+        super(MpdIdleListener, self).__init__(name='MpdIdle', daemon=True)
+        self._connection_factory = connection_factory
+        self._on_changes = on_changes
+        self._on_unsupported = on_unsupported
+        self._on_error = on_error
+        self._wakeup_secs = wakeup_secs
+        self._running = False
+
+    def run(self):
+        self._running = True
+        client = None
+        try:
+            client = self._connection_factory()
+            if 'idle' not in client.commands():
+                self._on_unsupported(self)
+                return
+            while self._running:
+                changed = self._wait_for_changes(client)
+                if changed:
+                    self._on_changes(changed)
+        except mpd2.CommandError:
+            self._on_unsupported(self)
+        except (mpd2.MPDError, OSError) as e:
+            if self._running:
+                self._on_error(self, e)
+        finally:
+            self._running = False
+            if client is not None:
+                try:
+                    client.disconnect()
+                except (mpd2.MPDError, OSError):
+                    pass
+
+    def _wait_for_changes(self, client):
+        """
+        Blocks until the server reports a change. The socket is
+        polled with a timeout so that stop() is noticed promptly.
+        Returns None if the listener was stopped while waiting.
+        """
+        client.send_idle(*MpdIdleListener.Subsystems)
+        while self._running:
+            ready, _, _ = select.select([client], [], [], self._wakeup_secs)
+            if ready:
+                return client.fetch_idle()
+        return None
+
+    def stop(self):
+        self._running = False
+
+
 class MpdHeartbeat(GObject.GObject):
     """
-    Ideally MPD would allow a client to register itself to receive
-    status pushes, so that a client can update in a reactive way as
-    needed. MPD currently does not support that kind of model; the
-    idle command is sort of in that vein, but isn't all that useful.
-    So instead we create a heartbeat with the server that polls on an
-    interval.
+    Tracks the player state and emits signals as it changes. The
+    server pushes change notifications via the idle command, which
+    is listened for on a dedicated connection; each changed subsystem
+    results in a refresh of just the state it affects. If the server
+    does not support idle, the heartbeat falls back to polling the
+    status on an interval; if the idle connection fails, it polls
+    until idle can be tried again.
+
+    While a song is playing, the elapsed time is advanced locally
+    rather than by asking the server for it.
 
     The only needed interaction with an instance of the heartbeat is
     to call connect() to receive event notification. It also will need
@@ -455,6 +1032,8 @@ class MpdHeartbeat(GObject.GObject):
     SIG_PLAYBACK_MODE_TOGGLED = 'playback_mode_toggled'
     SIG_UPDATING_DB = 'updatingdb'
 
+    IdleRetrySecs = 30
+
     __gsignals__ = {
         SIG_PLAYLIST_CHANGED: (GObject.SignalFlags.RUN_FIRST, None, ()),
         SIG_SONG_ELAPSED: (GObject.SignalFlags.RUN_FIRST, None, (float, float)),
@@ -494,6 +1073,17 @@ class MpdHeartbeat(GObject.GObject):
         }.items():
             self._state.connect(f'notify::{prop}', fn)
         self._scheduled_hb = None
+        self._scheduled_tick = None
+        self._idle_listener = None
+        self._scheduled_idle_retry = None
+        self._status_time = time.monotonic()
+        self._refreshes = {
+            'player': self._refresh_status,
+            'playlist': self._refresh_playlist,
+            'database': self._refresh_library,
+            'options': self._refresh_status,
+            'update': self._refresh_status
+        }
         self._connstatus.connect('mpd_connected', self._on_connect)
 
     def _on_connect(self, statusobj, connected):
@@ -503,18 +1093,140 @@ class MpdHeartbeat(GObject.GObject):
             self.stop()
 
     def start(self):
+        if self._idle_listener is None and self._scheduled_hb is None:
+            self._idle_listener = MpdIdleListener(
+                self._client.create_connection,
+                self._on_idle_changes,
+                self._on_idle_unsupported,
+                self._on_idle_error
+            )
+            self._idle_listener.start()
+            self._thread.execute(self._refresh_status)
+            self._thread.execute(self._refresh_playlist)
+
+    def stop(self):
+        self._state.reset()
+        if self._idle_listener is not None:
+            self._idle_listener.stop()
+            self._idle_listener = None
+        self._cancel_idle_retry()
+        self._stop_polling()
+        self._stop_ticking()
+
+    def _start_polling(self):
         if self._scheduled_hb is None:
             self._scheduled_hb = self._thread.schedule_periodic(
                 self._delay,
                 self._on_hb_interval
             )
 
-    def stop(self):
-        self._state.reset()
+    def _stop_polling(self):
         if self._scheduled_hb:
             self._scheduled_hb.cancel()
             self._scheduled_hb = None
 
+    def _start_ticking(self):
+        if self._scheduled_tick is None:
+            self._scheduled_tick = self._thread.schedule_periodic(
+                self._delay,
+                self._on_tick
+            )
+
+    def _stop_ticking(self):
+        if self._scheduled_tick:
+            self._scheduled_tick.cancel()
+            self._scheduled_tick = None
+
+    def _is_idling(self):
+        return self._idle_listener is not None and self._scheduled_hb is None
+
+    def _on_idle_changes(self, subsystems):
+        """
+        Called on the idle listener's thread. Each subsystem maps to
+        the refresh that picks up its changes; refreshes shared by
+        several subsystems are only run once.
+        """
+        refreshes = []
+        for name in subsystems:
+            refresh = self._refreshes.get(name, None)
+            if refresh is not None and refresh not in refreshes:
+                refreshes.append(refresh)
+        for refresh in refreshes:
+            self._thread.execute(refresh)
+
+    def _on_idle_unsupported(self, listener):
+        self.logger.warning('idle is not supported, polling for status')
+        self._thread.execute(
+            partial(self._fall_back_to_polling, listener, False)
+        )
+
+    def _on_idle_error(self, listener, e):
+        self.logger.error(f'idle connection failed: {e}')
+        self._thread.execute(
+            partial(self._fall_back_to_polling, listener, True)
+        )
+
+    def _fall_back_to_polling(self, listener, retry):
+        """
+        Switches to polling when the given listener fails. A failure
+        reported by a listener that has since been replaced or stopped
+        is ignored. If retry is set, idle is tried again later.
+        """
+        if listener is not self._idle_listener:
+            return
+        self._idle_listener = None
+        self._stop_ticking()
+        self._start_polling()
+        if retry:
+            self._scheduled_idle_retry = self._thread.schedule(
+                MpdHeartbeat.IdleRetrySecs,
+                self._retry_idle
+            )
+
+    def _retry_idle(self):
+        self._scheduled_idle_retry = None
+        if self._idle_listener is not None or self._scheduled_hb is None:
+            return
+        self._stop_polling()
+        self.start()
+
+    def _cancel_idle_retry(self):
+        if self._scheduled_idle_retry:
+            self._scheduled_idle_retry.cancel()
+            self._scheduled_idle_retry = None
+
+    def _refresh_status(self):
+        self._client.status(self._on_status)
+
+    def _refresh_playlist(self):
+        # The play queue is synced by whoever handles the signal, so
+        # there is no need to ask the server for the status first.
+        self.emit(MpdHeartbeat.SIG_PLAYLIST_CHANGED)
+
+    def _refresh_library(self):
+        self._client.refresh_library()
+
+    def _on_status(self, status):
+        # The status callback runs on the same thread that the
+        # heartbeat executes on, so the state can be updated here.
+        self._mpd_status = status
+        self._status_time = time.monotonic()
+        self._state.update(self._mpd_status)
+        # The state notify only fires on a change, so a song that kept
+        # playing while idle was down would otherwise not tick again.
+        if self._is_idling() and self._is_playing():
+            self._start_ticking()
+
+    def _on_tick(self):
+        """
+        Advances the elapsed time of the playing song without
+        asking the server, since idle does not report it.
+        """
+        if self._is_playing():
+            delta = time.monotonic() - self._status_time
+            self._state.advance_elapsed(delta)
+        return True
+
     def connect(self, signal_name, handler, *args):
         """
         Clients should use this method to subscribe to the events this
@@ -529,23 +1241,16 @@ class MpdHeartbeat(GObject.GObject):
         )
 
     def _on_hb_interval(self):
-        def on_status(status):
-            self._mpd_status = status
-            self._state.update(self._mpd_status)
-
-        # Not strictly needed since the hb is typically created
-        # with the same thread that is passed to the mpd client.
-        def on_hb_thread(status):
-            self._thread.execute(partial(on_status, status))
-
-        self._client.status(on_hb_thread)
+        self._refresh_status()
         return True
 
     def _on_state_change(self, obj, spec):
-        self.emit(
-            MpdHeartbeat.SIG_SONG_PLAYING_STATUS,
-            self._state.get_property(spec.name)
-        )
+        state = self._state.get_property(spec.name)
+        if self._is_idling() and state == 'play':
+            self._start_ticking()
+        else:
+            self._stop_ticking()
+        self.emit(MpdHeartbeat.SIG_SONG_PLAYING_STATUS, state)
 
     def _on_song_change(self, obj, spec):
         songid = self._state.get_property(spec.name)
@@ -570,10 +1275,13 @@ class MpdHeartbeat(GObject.GObject):
         self._client.currentsong(on_current_song)
 
     def _on_playlist_change(self, obj, spec):
-        self.emit(MpdHeartbeat.SIG_PLAYLIST_CHANGED)
+        # While idling, the playlist subsystem reports these changes.
+        if not self._is_idling():
+            self.emit(MpdHeartbeat.SIG_PLAYLIST_CHANGED)
 
     def _on_playlistlength_change(self, obj, spec):
-        self.emit(MpdHeartbeat.SIG_PLAYLIST_CHANGED)
+        if not self._is_idling():
+            self.emit(MpdHeartbeat.SIG_PLAYLIST_CHANGED)
 
     def _on_updating(self, obj, spec):
         propval = self._state.get_property(spec.name)
@@ -0,0 +1,88 @@
+class QueueChanges:
+    """
+    Describes how the play queue changed between two versions. The
+    entries are the queue items whose position changed or which are
+    new, ordered by position. The queue now has length items; any
+    beyond that were removed. If reset is True, the entries are the
+    whole queue and any previous contents should be discarded.
+    """
+
+    def __init__(self, entries, length, reset):
+        self.entries = entries
+        self.length = length
+        self.reset = reset
+
+
+class PlayQueue:
+    """
+    A client-side copy of the server's play queue, tagged with the
+    playlist version from the server status. After the first full
+    fetch, it is kept current by asking the server only for what has
+    changed since the version it holds.
+
+    Instances are not thread safe; they are meant to be used only
+    from the executor thread that talks to the server.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._version = None
+        self._entries = []
+
+    def version(self):
+        return self._version
+
+    def entries(self):
+        return list(self._entries)
+
+    def sync(self, client, mpdstatus, fetch_by_ids):
+        """
+        Brings the copy up to date with the version in mpdstatus and
+        returns a QueueChanges, or None if nothing changed.
+
+        Changes are read with plchangesposid, which only reports the
+        new position of each song id. Songs already in the copy are
+        moved without their tags being sent again; fetch_by_ids is
+        called with the ids that are new to the copy and must return
+        their queue entries.
+        """
+        version = mpdstatus.get('playlist', None)
+        length = int(mpdstatus.get('playlistlength', 0))
+        if version is None or version == self._version:
+            return None
+        if self._version is None:
+            self._entries = list(client.playlistinfo())
+            self._version = version
+            return QueueChanges(self.entries(), len(self._entries), True)
+
+        moves = client.plchangesposid(self._version)
+        by_id = {e['id']: e for e in self._entries if e is not None}
+        unknown = [m['id'] for m in moves if m['id'] not in by_id]
+        if unknown:
+            for entry in fetch_by_ids(unknown):
+                by_id[entry['id']] = entry
+            if any(i not in by_id for i in unknown):
+                # A song was deleted after plchangesposid listed it, so
+                # the queue has already moved past version. Start over
+                # with a full fetch; the next sync catches up from it.
+                self.clear()
+                return self.sync(client, mpdstatus, fetch_by_ids)
+
+        del self._entries[length:]
+        changed = []
+        for move in moves:
+            pos = int(move['cpos'])
+            entry = dict(by_id[move['id']])
+            entry['pos'] = move['cpos']
+            if pos >= len(self._entries):
+                self._entries.extend([None] * (pos + 1 - len(self._entries)))
+            self._entries[pos] = entry
+            changed.append(entry)
+        self._version = version
+        return QueueChanges(changed, length, False)
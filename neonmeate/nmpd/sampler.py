@@ -0,0 +1,149 @@
+import random
+from array import array
+from collections import Counter, deque
+
+
+class SongSampler:
+    """
+    Picks random songs from a cached list of every song URI in the
+    library. The URIs are packed into a single byte array with an
+    array of offsets, which takes a fraction of the memory of a list
+    of strings (let alone a list of song dicts), and an individual URI
+    is only decoded when it is picked.
+
+    The list is tagged with the db_update time it was built for, so
+    it only needs rebuilding when the server's database changes.
+    Songs that were picked recently are avoided where possible.
+    """
+
+    def __init__(self, recent_limit=1000):
+        self._stamp = None
+        self._blob = bytearray()
+        self._offsets = array('Q', [0])
+        self._recent = deque(maxlen=recent_limit)
+        # How many times each index is in the deque; an index can be
+        # picked again once everything else has been played recently.
+        self._recent_counts = Counter()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def is_stale(self, stamp):
+        return self._stamp is None or self._stamp != stamp
+
+    def refresh(self, uris, stamp):
+        """Replaces the URIs with those from the iterable."""
+        blob = bytearray()
+        offsets = array('Q', [0])
+        for uri in uris:
+            blob += uri.encode('utf-8')
+            offsets.append(len(blob))
+        self._blob = blob
+        self._offsets = offsets
+        self._stamp = stamp
+        self._recent.clear()
+        self._recent_counts.clear()
+
+    def uri(self, index):
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return self._blob[start:end].decode('utf-8')
+
+    def sample(self, k, rng=random, exclude_recent=True):
+        """
+        Returns k distinct URIs picked at random, or all of them if
+        there are fewer than k. This costs O(k), not O(n).
+        """
+        n = len(self)
+        k = min(k, n)
+        avoid = self._recent_counts if exclude_recent else {}
+        if k + len(avoid) > n // 2:
+            # Rejection sampling would thrash. This only happens when
+            # the library is small next to the recent list, so it is
+            # cheap to pick from the songs not played recently.
+            indices = self._sample_avoiding(k, n, avoid, rng)
+        else:
+            chosen = set()
+            indices = []
+            while len(indices) < k:
+                i = rng.randrange(n)
+                if i not in chosen and i not in avoid:
+                    chosen.add(i)
+                    indices.append(i)
+        self._remember(indices)
+        return [self.uri(i) for i in indices]
+
+    def _sample_avoiding(self, k, n, avoid, rng):
+        """
+        Picks k indices from those not in avoid. If there are not
+        enough of them, the rest are the songs played longest ago.
+        """
+        fresh = [i for i in range(n) if i not in avoid]
+        if len(fresh) >= k:
+            return rng.sample(fresh, k)
+        last_played = {i: pos for pos, i in enumerate(self._recent)}
+        oldest = sorted(last_played, key=last_played.get)
+        indices = fresh + oldest[:k - len(fresh)]
+        rng.shuffle(indices)
+        return indices
+
+    def _remember(self, indices):
+        for i in indices:
+            if len(self._recent) == self._recent.maxlen:
+                evicted = self._recent[0]
+                self._recent_counts[evicted] -= 1
+                if self._recent_counts[evicted] == 0:
+                    del self._recent_counts[evicted]
+            self._recent.append(i)
+            self._recent_counts[i] += 1
+
+
+def benchmark(n=400000, k=50, rounds=20):
+    """
+    Compares the sampler with the way random songs used to be picked:
+    holding a dict per database entry (as listall returns them) and
+    choosing from that list. Only the client side is measured; the
+    old way also had to download every entry first.
+    """
+    import time
+    import tracemalloc
+
+    uris = [f'Artist {i % 5000}/Album {i % 40000}/{i:06} - Song title.flac'
+            for i in range(n)]
+
+    def measure(label, build, pick):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        built = build()
+        t1 = time.perf_counter()
+        for _ in range(rounds):
+            pick(built)
+        t2 = time.perf_counter()
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{label}: build {1000 * (t1 - t0):.1f} ms, '
+              f'pick {1000 * (t2 - t1) / rounds:.3f} ms, '
+              f'held {held / 2 ** 20:.1f} MiB, '
+              f'peak {peak / 2 ** 20:.1f} MiB')
+
+    def build_records():
+        # Fresh strings, as they would arrive off the socket.
+        return [r for r in ({'file': u.encode().decode()} for u in uris)
+                if 'file' in r]
+
+    def pick_records(records):
+        return [r['file'] for r in random.choices(records, k=k)]
+
+    def build_sampler():
+        s = SongSampler()
+        s.refresh(uris, '1')
+        return s
+
+    def pick_sampler(s):
+        return s.sample(k)
+
+    measure('listall records', build_records, pick_records)
+    measure('song sampler', build_sampler, pick_sampler)
+
+
+if __name__ == '__main__':
+    benchmark()
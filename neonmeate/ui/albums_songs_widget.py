@@ -6,7 +6,7 @@ from neonmeate.ui.toolkit import glib_main
 
 class AlbumsAndSongs(Gtk.Box):
 
-    def __init__(self, mpdclient, art_cache, placeholder_pixbuf,
+    def __init__(self, mpdclient, art_cache, executor, placeholder_pixbuf,
                  albums_view_options, border_style_context):
         super(AlbumsAndSongs, self).__init__()
         self.set_hexpand(True)
@@ -16,6 +16,7 @@ class AlbumsAndSongs(Gtk.Box):
         self._albums = Albums(
             self._mpdclient,
             self._art_cache,
+            executor,
             placeholder_pixbuf,
             albums_view_options,
             border_style_context
@@ -45,6 +46,9 @@ class AlbumsAndSongs(Gtk.Box):
     def on_theme_change(self):
         self._albums.on_theme_change()
 
+    def on_shown(self, shown):
+        self._albums.on_shown(shown)
+
     def clear(self):
         self._albums.clear()
         self._selected_artist = None
@@ -1,12 +1,55 @@
+import cairo
+
 from gi.repository import Gtk, GObject, GLib, Pango, Gdk
 
 from neonmeate.ui.songs_menu_widget import SongsMenu
-from neonmeate.ui.toolkit import add_pixbuf_border, AlbumArt
+from neonmeate.ui.toolkit import add_pixbuf_border, add_surface_border, \
+    pixbuf_to_surface, AlbumArt, glib_main
+from neonmeate.util.art import ArtPriority
+from neonmeate.util.thread import on_main_when_done
+
+
+class ViewportTracker:
+    """
+    Follows which items of an icon view are in view. Whenever that
+    may have changed, e.g. after scrolling or resizing, on_change is
+    called with the index of the first and last item in view and how
+    many items there are in a row. Changes are coalesced, so it is
+    called at most once per main loop iteration.
+    """
+
+    def __init__(self, view, vadjustment, on_change):
+        self._view = view
+        self._on_change = on_change
+        self._update_id = None
+        vadjustment.connect('value-changed', self.queue_update)
+        vadjustment.connect('changed', self.queue_update)
+
+    def queue_update(self, *_):
+        if self._update_id is None:
+            self._update_id = GLib.idle_add(self._update)
+
+    def _update(self):
+        self._update_id = None
+        visible = self._view.get_visible_range()
+        if visible:
+            start, end = visible
+            first, last = start.get_indices()[0], end.get_indices()[0]
+            rows = self._view.get_item_row(end) - \
+                self._view.get_item_row(start) + 1
+            per_row = max(1, -(-(last - first + 1) // rows))
+            self._on_change(first, last, per_row)
+        return False
 
 
 class Albums(Gtk.ScrolledWindow):
     SIG_ALBUM_SELECTED = 'album_selected'
 
+    # Art is loaded for this many rows beyond those in view, and kept
+    # for this many; anything further away is released.
+    LookaheadRows = 2
+    RetainRows = 8
+
     __gsignals__ = {
         SIG_ALBUM_SELECTED: (GObject.SignalFlags.RUN_FIRST, None, (int,))
     }
@@ -15,8 +58,8 @@ class Albums(Gtk.ScrolledWindow):
     def album_sort_key(album):
         return album.date, album.title, album.artist
 
-    def __init__(self, mpdclient, art_cache, placeholder_pixbuf, options,
-                 border_style_context):
+    def __init__(self, mpdclient, art_cache, executor, placeholder_pixbuf,
+                 options, border_style_context):
         super(Albums, self).__init__()
         self.set_shadow_type(Gtk.ShadowType.NONE)
         self._border_style_context = border_style_context
@@ -25,6 +68,7 @@ class Albums(Gtk.ScrolledWindow):
         self._album_spacing = options.col_spacing
         self.set_min_content_width(self._album_width_px + self._album_spacing)
         self._art = art_cache
+        self._executor = executor
         self._mpdclient = mpdclient
         self._options = options
         self._model = Gtk.ListStore(GObject.TYPE_PYOBJECT)
@@ -37,7 +81,22 @@ class Albums(Gtk.ScrolledWindow):
         self._view.set_item_width(self._album_width_px)
         self._view.connect('query-tooltip', self._on_tooltip)
         self.add(self._view)
+        # The scale factor is known once realized; the atlas of that
+        # size is opened then, in a worker, so it is ready to draw from.
+        self.connect('realize', lambda w: self._art.open_atlas(
+            self._album_width_px * self.get_scale_factor()))
+        # The finished tiles, with borders, and the artwork they were
+        # made from, so that a change of theme only redoes borders.
         self._surface_cache = {}
+        self._art_surfaces = {}
+        self._preparing = set()
+        self._generation = 0
+        self._shown = True
+        self._wanted = (0, -1)
+        # The rows whose art is kept, from the last viewport change.
+        self._retained = (0, -1)
+        self._tracker = ViewportTracker(self._view, self.get_vadjustment(),
+                                        self._on_viewport_change)
 
         renderer = Gtk.CellRendererPixbuf()
         self._view.pack_start(renderer, False)
@@ -46,31 +105,10 @@ class Albums(Gtk.ScrolledWindow):
             add_pixbuf_border(self._placeholder_pixbuf, self._border_color,
                               border_width=0))
 
-        def render_cover(view, cell, model, iter, placeholder_pb):
+        def render_cover(view, cell, model, iter, data):
+            # Tiles are prepared in workers; this only picks them up.
             album = model[iter][0]
             surface = self._surface_cache.get(album, self._placeholder_surface)
-            if surface != self._placeholder_surface:
-                cell.set_property('surface', surface)
-                return
-            if album.art is None:
-                album.art = AlbumArt(art_cache, album, placeholder_pb)
-                row = Gtk.TreeRowReference.new(model, model.get_path(iter))
-
-                def on_art_ready(ready_pb, _):
-                    path = row.get_path()
-                    if path:
-                        model.row_changed(path, model.get_iter(path))
-                    self.queue_draw()
-
-                album.art.resolve(on_art_ready, None)
-            elif album.art.is_resolved():
-                pb = add_pixbuf_border(
-                    album.art.get_scaled_pixbuf(self._album_width_px),
-                    self._get_border_color(),
-                    border_width=self._options.border_width
-                )
-                surface = self.pixbuf_surface(pb)
-                self._surface_cache[album] = surface
             cell.set_property('surface', surface)
 
         self._view.set_cell_data_func(renderer, render_cover, None)
@@ -96,7 +134,142 @@ class Albums(Gtk.ScrolledWindow):
         self.show_all()
 
     def on_theme_change(self):
+        self._generation += 1
+        self._preparing.clear()
         self._surface_cache.clear()
+        self._tracker.queue_update()
+
+    def on_shown(self, shown):
+        self._shown = shown
+        if shown:
+            self._tracker.queue_update()
+        else:
+            AlbumArt.prioritize_all(
+                [row[0].art for row in self._model
+                 if row[0].art is not None],
+                ArtPriority.SPECULATIVE)
+
+    def _on_viewport_change(self, first, last, per_row):
+        """
+        Requests art for the albums in view and a few rows beyond,
+        visible ones first, and releases the art of albums that are
+        far out of view so memory use does not grow with the number
+        of albums. Only the rows near the viewport, and those that
+        have just moved away from it, are looked at.
+        """
+        count = len(self._model)
+        ahead = Albums.LookaheadRows * per_row
+        retain = Albums.RetainRows * per_row
+        self._wanted = (max(0, first - ahead), min(count - 1, last + ahead))
+        old_lo, old_hi = self._retained
+        lo, hi = max(0, first - retain), min(count - 1, last + retain)
+        self._retained = (lo, hi)
+        for i in range(old_lo, min(old_hi, count - 1) + 1):
+            if not lo <= i <= hi:
+                self._release_art(self._model[i][0])
+
+        near_priority = ArtPriority.NEAR if self._shown else \
+            ArtPriority.SPECULATIVE
+        visible_arts, near_arts = [], []
+        for i in range(self._wanted[0], self._wanted[1] + 1):
+            row = self._model[i]
+            album = row[0]
+            visible = first <= i <= last
+            if album.art is not None:
+                (visible_arts if visible else near_arts).append(album.art)
+            elif album not in self._surface_cache and \
+                    album not in self._preparing:
+                self._request_tile(album, row.path, visible)
+        AlbumArt.prioritize_all(near_arts, near_priority)
+        AlbumArt.prioritize_all(visible_arts, ArtPriority.VISIBLE
+                                if self._shown else near_priority)
+        self._view.queue_draw()
+
+    def _request_tile(self, album, path, visible):
+        art = self._art_surfaces.get(album, None)
+        if art is None:
+            size = self._album_width_px * self.get_scale_factor()
+            art = self._art.atlas_tile(album.dirpath, size)
+        if art is not None:
+            self._prepare_tile(album, path, art)
+            return
+        album.art = AlbumArt(self._art, album, self._placeholder_pixbuf,
+                             self._album_width_px * self.get_scale_factor())
+        row = Gtk.TreeRowReference.new(self._model, path)
+
+        def on_art_ready(ready_pb, _):
+            # The pixbuf is only needed until its tile is made.
+            album.art = None
+            path = row.get_path()
+            if path:
+                self._prepare_tile(album, path, ready_pb)
+
+        if not self._shown:
+            priority = ArtPriority.SPECULATIVE
+        elif visible:
+            priority = ArtPriority.VISIBLE
+        else:
+            priority = ArtPriority.NEAR
+        album.art.resolve(on_art_ready, None, priority)
+
+    def _prepare_tile(self, album, path, art):
+        """
+        Makes the album's tile in a worker: the artwork (a pixbuf, or
+        a surface from the atlas) is scaled if need be and a border
+        drawn around it. The tile is picked up by the renderer once
+        it is ready.
+        """
+        scale = self.get_scale_factor()
+        size = self._album_width_px * scale
+        border_width = self._options.border_width * scale
+        color = self._get_border_color()
+        generation = self._generation
+        row = Gtk.TreeRowReference.new(self._model, path)
+        self._preparing.add(album)
+
+        def work():
+            surface = art
+            if not isinstance(surface, cairo.ImageSurface):
+                # Fitted to the tile keeping its aspect ratio, as the
+                # atlas's tiles are.
+                w, h = surface.get_width(), surface.get_height()
+                fit = size / max(w, h)
+                surface = pixbuf_to_surface(surface.scale_simple(
+                    max(1, round(w * fit)), max(1, round(h * fit)),
+                    AlbumArt.ScaleMode))
+            return surface, add_surface_border(surface, color, border_width,
+                                               scale)
+
+        def on_ready(surfaces):
+            # Dropped if the view was cleared or restyled, or the album
+            # released, while the tile was being made.
+            if generation != self._generation or \
+                    album not in self._preparing:
+                return
+            self._preparing.discard(album)
+            if surfaces is None:
+                # The work failed; the error has been logged.
+                return
+            self._art_surfaces[album], self._surface_cache[album] = surfaces
+            path = row.get_path()
+            if path:
+                self._model.row_changed(path, self._model.get_iter(path))
+
+        @glib_main
+        def on_error(e):
+            if generation == self._generation:
+                self._preparing.discard(album)
+
+        on_main_when_done(self._executor.execute_async(work), on_ready,
+                          on_error)
+
+    def _release_art(self, album):
+        self._surface_cache.pop(album, None)
+        self._art_surfaces.pop(album, None)
+        self._preparing.discard(album)
+        if album.art is not None:
+            album.art.cancel()
+            album.art = None
 
     def _get_border_color(self):
         flags = Gtk.StateFlags.NORMAL
@@ -105,12 +278,20 @@ class Albums(Gtk.ScrolledWindow):
     def _on_button_press(self, widget, event):
         path, path_iter = self._get_path_at_position(event, widget)
         if path:  # event.button == Gdk.BUTTON_PRIMARY and path:
-            popover = SongsMenu(self._model[path_iter][0], self._mpdclient)
             ok, rect = self._view.get_cell_rect(path)
             if ok:
-                popover.set_pointing_to(rect)
-                popover.set_relative_to(self)
-                popover.popup()
+                album = self._model[path_iter][0]
+
+                # Albums are listed without their songs, which are
+                # only loaded once the album is opened.
+                @glib_main
+                def on_songs_loaded(loaded_album):
+                    popover = SongsMenu(loaded_album, self._mpdclient)
+                    popover.set_pointing_to(rect)
+                    popover.set_relative_to(self)
+                    popover.popup()
+
+                self._mpdclient.load_album_songs(album, on_songs_loaded)
                 return True
         return False
 
@@ -154,7 +335,11 @@ class Albums(Gtk.ScrolledWindow):
 
     def clear(self):
         self._clear_albums()
-        self._surface_cache.clear()
+
+    def _cancel_art(self):
+        for row in self._model:
+            if row[0].art is not None:
+                row[0].art.cancel()
 
     def get_selected_album(self):
         return self._selected_album
@@ -166,13 +351,20 @@ class Albums(Gtk.ScrolledWindow):
     def _clear_albums(self):
         self._selected_artist = None
         self._selected_album = None
+        self._cancel_art()
+        self._wanted = (0, -1)
+        self._retained = (0, -1)
+        self._generation += 1
+        self._preparing.clear()
+        self._surface_cache.clear()
+        self._art_surfaces.clear()
         self._model.clear()
 
     def on_artist_selected(self, artist_name, albums):
         if not artist_name or self._selected_artist == artist_name:
             return
         self._clear_albums()
-        self._surface_cache.clear()
         self._selected_artist = artist_name
         for album in sorted(list(albums), key=Albums.album_sort_key):
             self._model.append([album])
+        self._tracker.queue_update()
@@ -10,6 +10,7 @@ from .playlist import PlaylistContainer
 from .settings import SettingsMenu
 from .toolkit import glib_main
 from ..nmpd.mpdlib import MpdHeartbeat as Hb
+from ..util.art import ArtPriority
 
 
 class App(Gtk.ApplicationWindow):
@@ -21,6 +22,11 @@ class App(Gtk.ApplicationWindow):
         'stop': (False, True)
     }
 
+    # How many queue entries before and after the current song have
+    # their covers loaded ahead of time.
+    PrefetchBehind = 5
+    PrefetchAhead = 20
+
     def __init__(self, rng, mpdclient, executor, art_cache, mpd_hb, cfg,
                  configstate, connstatus):
         Gtk.ApplicationWindow.__init__(self, title=App.Title)
@@ -35,6 +41,10 @@ class App(Gtk.ApplicationWindow):
         self._mpdclient = mpdclient
         self._art = art_cache
         self._playlist_updated = False
+        self._connect_requested = False
+        self._playing_file = None
+        self._cover_handle = None
+        self._queue_files = []
         self.set_default_size(860, 860)
         self._titlebar = Gtk.HeaderBar()
         self._titlebar.set_title("NeonMeate")
@@ -93,7 +103,8 @@ class App(Gtk.ApplicationWindow):
         )
 
         style_ctx = self._settings.get_style_context()
-        self._artists = ArtistsAlbums(mpdclient, art_cache, cfg, style_ctx)
+        self._artists = ArtistsAlbums(mpdclient, art_cache, executor, cfg,
+                                      style_ctx)
         self._playlist.connect(
             PlaylistContainer.SIG_RANDOM_FILL,
             self._on_random_fill
@@ -138,11 +149,14 @@ class App(Gtk.ApplicationWindow):
         )
         self._mpdhb.connect(Hb.SIG_PLAYBACK_MODE_TOGGLED, self._on_mode_change)
         self._mpdhb.connect(Hb.SIG_UPDATING_DB, self._on_updating_db)
+        self._connstatus.connect('mpd_connected', self._on_mpd_connected)
 
     def _on_theme_change(self, param1, param2):
         self._artists.on_theme_change()
 
     def _on_stack_change(self, s, obj):
+        self._artists.on_shown(
+            'library' == self._stack.get_visible_child_name())
         if 'playlist' == self._stack.get_visible_child_name():
             self._stack.child_set_property(
                 self._playlist,
@@ -160,6 +174,19 @@ class App(Gtk.ApplicationWindow):
     def _on_update_request(self, _):
         self._mpdclient.update()
 
+    def _on_mpd_connected(self, connstatus, connected):
+        # The artists are loaded when the user asks to connect. After
+        # the client reconnects on its own, they are reloaded to pick
+        # up any changes made on the server in the meantime.
+        if connected and not self._connect_requested:
+            self._artists.on_mpd_connected(True)
+        self._connect_requested = False
+        if connected and self._cfg.warm_covers():
+            self._mpdclient.find_all_albums(self._warm_covers)
+
+    def _warm_covers(self, albums):
+        self._art.warm_covers(a.dirpath for a in albums)
+
     def on_connect_attempt(self, settings, host, port, should_connect):
         with self._settings.handler_block(self._connect_handler):
             if self._connstatus == should_connect:
@@ -167,6 +194,7 @@ class App(Gtk.ApplicationWindow):
             if should_connect:
                 if self._playlist_updated:
                     self._playlist_updated = False
+                self._connect_requested = True
                 self._mpdclient.connect()
                 self._artists.on_mpd_connected(True)
             else:
@@ -174,6 +202,7 @@ class App(Gtk.ApplicationWindow):
                 self._titlebar.set_title('NeonMeate')
                 self._artists.on_mpd_connected(False)
                 self._playlist.clear()
+                self._queue_files = []
                 self._now_playing.on_connection_status(False)
                 self._mpdclient.disconnect()
 
@@ -194,39 +223,53 @@ class App(Gtk.ApplicationWindow):
             self._artists.on_playlist_modified()
 
         @glib_main
-        def on_current_queue(playqueue):
-            self._update_play_queue(playqueue)
+        def on_queue_changes(changes):
+            if changes is not None:
+                self._update_play_queue(changes)
             self._playlist_updated = True
 
-        self._mpdclient.playlistinfo(on_current_queue)
+        self._mpdclient.sync_play_queue(on_queue_changes)
 
-    def _update_play_queue(self, playqueue):
-        self._playlist.clear()
-        artist_elems = [e for e in playqueue if 'artist' in e]
-        for elem in artist_elems:
+    def _update_play_queue(self, changes):
+        if changes.reset:
+            self._playlist.clear()
+            self._queue_files = []
+        self._playlist.truncate(changes.length)
+        del self._queue_files[changes.length:]
+        for elem in changes.entries:
             queue_elem = App._track_details_from_queue_elem(elem)
-            artist = queue_elem['artist']
-            album = queue_elem['album']
-            self._playlist.add_playlist_item(queue_elem)
-            cover_path = self._art.resolve_cover_file(
-                os.path.dirname(elem['file']))
-            self._on_resolved_cover_path(cover_path, artist, album)
-
-    def _on_resolved_cover_path(self, cover_path, artist, album):
-        if cover_path is None:
-            self.logger.warning(f"Cover not found for {artist} {album}")
-        else:
-            self._art.fetch(cover_path, None, None)
+            self._playlist.set_playlist_item(queue_elem)
+            pos = queue_elem['position']
+            if pos >= len(self._queue_files):
+                missing = pos + 1 - len(self._queue_files)
+                self._queue_files.extend([None] * missing)
+            self._queue_files[pos] = elem['file']
+        self._prefetch_queue_covers()
+
+    def _prefetch_queue_covers(self):
+        """
+        Loads the covers of the songs around the current one in the
+        background, so they are ready when those songs play.
+        """
+        try:
+            current = self._queue_files.index(self._playing_file)
+        except ValueError:
+            current = 0
+        start = max(0, current - App.PrefetchBehind)
+        window = self._queue_files[start:current + App.PrefetchAhead]
+        self._art.prefetch(os.path.dirname(f) for f in window if f)
 
     @staticmethod
     def _track_details_from_queue_elem(elem):
         """
         Cleans up the playlist entries that come from MPD.
         """
-        artist, album, title = elem['artist'], elem['album'], elem['title']
-        track = int(elem['track'])
+        artist = elem.get('artist', '')
+        album = elem.get('album', '')
+        title = elem.get('title', os.path.basename(elem['file']))
+        track = int(elem.get('track', 0))
         position = int(elem['pos'])
-        duration = float(elem['duration'])
+        duration = float(elem.get('duration', 0))
         seconds = int(duration)
 
         if isinstance(title, list):
@@ -249,15 +292,29 @@ class App(Gtk.ApplicationWindow):
         if artist and title:
             title_text = f'{artist} - {title}'
         self._titlebar.set_title(title_text)
+        self._playing_file = filepath
+        if self._cover_handle is not None:
+            self._cover_handle.cancel()
+            self._cover_handle = None
         if artist is None:
             self._now_playing.clear()
             return
-        covpath = self._art.resolve_cover_file(os.path.dirname(filepath))
-        if covpath is None:
-            self.logger.error(f'File art not found for {filepath}')
-        else:
-            self._art.fetch(covpath, None, None)
-            self._now_playing.on_playing(artist, album, covpath)
+        self._prefetch_queue_covers()
+
+        @glib_main
+        def on_cover_path(covpath):
+            if filepath != self._playing_file:
+                return
+            if covpath is None:
+                self.logger.error(f'File art not found for {filepath}')
+            else:
+                self._now_playing.on_playing(artist, album, covpath)
+
+        self._cover_handle = self._art.async_resolve_cover_file(
+            os.path.dirname(filepath),
+            on_cover_path,
+            priority=ArtPriority.NOW_PLAYING
+        )
 
     def _on_song_playing_status(self, hb, status):
         paused, stopped = App.PlayStatus.get(status, (False, False))
@@ -17,7 +17,7 @@ class AlbumViewOptions:
 # noinspection PyUnresolvedReferences
 class ArtistsAlbums(Gtk.Overlay):
 
-    def __init__(self, mpdclient, art, cfg, style_context):
+    def __init__(self, mpdclient, art, executor, cfg, style_context):
         super(ArtistsAlbums, self).__init__()
         album_view_opts = AlbumViewOptions()
         self.set_hexpand(True)
@@ -55,6 +55,7 @@ class ArtistsAlbums(Gtk.Overlay):
         self._albums_songs = AlbumsAndSongs(
             self._mpdclient,
             self._art,
+            executor,
             self._album_placeholder_pixbuf,
             album_view_opts,
             style_context
@@ -67,6 +68,9 @@ class ArtistsAlbums(Gtk.Overlay):
     def on_theme_change(self):
         self._albums_songs.on_theme_change()
 
+    def on_shown(self, shown):
+        self._albums_songs.on_shown(shown)
+
     def on_playlist_modified(self):
         #self._infobar.temp_reveal("Playlist updated")
         pass
@@ -2,11 +2,12 @@ import cairo
 import gi
 import logging
 
-from gi.repository import GdkPixbuf, Gtk, Gdk
+from gi.repository import GdkPixbuf, GLib, Gtk
 
 from neonmeate.util import cluster
 from neonmeate.util.color import RGBColor
-from neonmeate.ui.toolkit import glib_main
+from neonmeate.ui.toolkit import glib_main, pixbuf_to_surface
+from neonmeate.util.thread import on_main_when_done
 
 gi.require_version('Gtk', '3.0')
 gi.require_foreign('cairo')
@@ -33,8 +34,20 @@ class Gradient:
 
 # noinspection PyUnresolvedReferences
 class CoverWithGradient(Gtk.DrawingArea):
+    """
+    Draws the cover on a gradient made from its colors.
+
+    The cover is scaled to fit in a worker thread, and only when the
+    size changes; drawing just paints the scaled copy. While the
+    window is being resized, the last scaled copy is stretched to fit
+    until resizing pauses and a new one is made.
+    """
     ScaleMode = GdkPixbuf.InterpType.BILINEAR
 
+    # How long the size must stay the same before the cover is
+    # scaled again.
+    RescaleDelayMs = 150
+
     @staticmethod
     def rand_switch(rng, a, b):
         if rng.randint(1, 100) >= 50:
@@ -52,8 +65,14 @@ class CoverWithGradient(Gtk.DrawingArea):
         self.edge_size = self.w
         self.set_size_request(self.h, self.w)
         self.pixbuf = pixbuf
+        self._executor = executor
+        self._scaled = None
+        self._scaling_generation = 0
+        self._rescale_id = None
+        self._pattern = None
         self.connect('draw', self.draw)
         self.connect('size-allocate', self.alloc)
+        self.connect('destroy', self._on_destroy)
         self._grad = Gradient.gray()
         self._border_rgb = 1, 1, 1
         self._is_default_grad = True
@@ -82,6 +101,7 @@ class CoverWithGradient(Gtk.DrawingArea):
                 self._cfg.save_clusters(self.artist, self.album, clusters,
                                         self.covpath)
 
+        self._rescale()
         border, bg = self._cfg.get_background(artist, album, covpath, rng)
 
         if border is not None and bg is not None:
@@ -98,7 +118,8 @@ class CoverWithGradient(Gtk.DrawingArea):
                 7,
                 0.001,
                 200,
-                'rgb')
+                'rgb',
+                mode='histogram')
             cluster_result.add_done_callback(on_gradient_ready)
 
     @glib_main
@@ -108,27 +129,84 @@ class CoverWithGradient(Gtk.DrawingArea):
             start_rgb = rgb
             stop_rgb = start_rgb.darken(18).saturate(5)
             self._grad = Gradient(start_rgb, stop_rgb)
+            self._pattern = None
             self._border_rgb = border_rgb.components()
             self.queue_draw()
 
     def alloc(self, widget, allocation):
+        if allocation.height != self.h:
+            self._pattern = None
         self.h = allocation.height
         self.w = allocation.width
         self.edge_size = min(self.w, self.h)
+        if self._scaled is None or self._scaled[0] != self._cover_edge():
+            if self._rescale_id is not None:
+                GLib.source_remove(self._rescale_id)
+            self._rescale_id = GLib.timeout_add(
+                CoverWithGradient.RescaleDelayMs, self._on_rescale_timeout)
+
+    def _on_destroy(self, widget):
+        if self._rescale_id is not None:
+            GLib.source_remove(self._rescale_id)
+            self._rescale_id = None
+        self._scaling_generation += 1
+
+    def _cover_edge(self):
+        return max(1, self.edge_size - 200)
+
+    def _on_rescale_timeout(self):
+        self._rescale_id = None
+        self._rescale()
+        return False
+
+    def _rescale(self):
+        """Scales the cover to the current size in a worker."""
+        edge = self._cover_edge()
+        self._scaling_generation += 1
+        generation = self._scaling_generation
+        pixbuf = self.pixbuf
+
+        def scale():
+            return pixbuf_to_surface(
+                pixbuf.scale_simple(edge, edge, CoverWithGradient.ScaleMode))
+
+        def on_scaled(surface):
+            if surface is not None and \
+                    generation == self._scaling_generation:
+                self._scaled = (edge, surface)
+                self.queue_draw()
+
+        on_main_when_done(self._executor.execute_async(scale), on_scaled)
+
+    def _gradient(self):
+        if self._pattern is None:
+            self._pattern = cairo.LinearGradient(0, 0, 0, self.h)
+            self._pattern.add_color_stop_rgb(0, *self._grad.start.rgb)
+            self._pattern.add_color_stop_rgb(1, *self._grad.stop.rgb)
+        return self._pattern
 
     def draw(self, draw_area_obj, ctx):
-        grad = cairo.LinearGradient(0, 0, 0, self.h)
-        grad.add_color_stop_rgb(0, *self._grad.start.rgb)
-        grad.add_color_stop_rgb(1, *self._grad.stop.rgb)
-        ctx.set_source(grad)
+        ctx.set_source(self._gradient())
         ctx.rectangle(0, 0, self.w, self.h)
         ctx.fill()
-        edge_size = self.edge_size - 200
-        p = self._scale(edge_size)
-        pixbuf_x = (self.w - p.get_width()) / 2
-        pixbuf_y = (self.h - p.get_height()) / 2
-        Gdk.cairo_set_source_pixbuf(ctx, p, pixbuf_x, pixbuf_y)
-        ctx.paint()
+        edge_size = self._cover_edge()
+        pixbuf_x = (self.w - edge_size) / 2
+        pixbuf_y = (self.h - edge_size) / 2
+        if self._scaled is not None:
+            scaled_edge, surface = self._scaled
+            ctx.save()
+            ctx.translate(pixbuf_x, pixbuf_y)
+            if scaled_edge != edge_size:
+                # Resizing; stretch the copy we have until a new one
+                # has been made.
+                factor = edge_size / scaled_edge
+                ctx.scale(factor, factor)
+                ctx.set_source_surface(surface, 0, 0)
+                ctx.get_source().set_filter(cairo.FILTER_FAST)
+            else:
+                ctx.set_source_surface(surface, 0, 0)
+            ctx.paint()
+            ctx.restore()
         ctx.set_line_width(self._border_thickness)
         r, g, b = self._border_rgb
         ctx.set_source_rgba(r, g, b, 1)
@@ -138,6 +216,3 @@ class CoverWithGradient(Gtk.DrawingArea):
         ctx.rectangle(rect_x, rect_y, rect_width, rect_width)
         ctx.stroke()
         return False
-
-    def _scale(self, size):
-        return self.pixbuf.scale_simple(size, size, CoverWithGradient.ScaleMode)
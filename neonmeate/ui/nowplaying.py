@@ -1,6 +1,7 @@
 from gi.repository import Gtk
 
 from .cover import CoverWithGradient
+from ..util.art import ArtPriority
 
 
 # noinspection PyUnresolvedReferences
@@ -14,13 +15,20 @@ class NowPlaying(Gtk.Frame):
         self._cover_art = None
         self._current = (None, None)
         self._covpath = None
+        self._art_handle = None
         self._box = Gtk.VBox()
         self.add(self._box)
 
     def clear(self):
         self._current = (None, None)
+        self._cancel_fetch()
         self._clear_art()
 
+    def _cancel_fetch(self):
+        if self._art_handle is not None:
+            self._art_handle.cancel()
+            self._art_handle = None
+
     def on_connection_status(self, connected):
         if not connected:
             self.clear()
@@ -29,9 +37,12 @@ class NowPlaying(Gtk.Frame):
         self._covpath = covpath
         if self._current == (artist, album):
             return
+        self._cancel_fetch()
         self._clear_art()
         self._current = (artist, album)
-        self._art.fetch(covpath, self._on_art_ready, (artist, album, covpath))
+        self._art_handle = self._art.fetch(
+            covpath, self._on_art_ready, (artist, album, covpath),
+            priority=ArtPriority.NOW_PLAYING)
 
     def switch_art(self):
         artist, album = self._current
@@ -56,6 +67,7 @@ class NowPlaying(Gtk.Frame):
         self._box.show_all()
 
     def _on_art_ready(self, pixbuf, artist_album_covpath):
+        self._art_handle = None
         artist, album, covpath = artist_album_covpath
         if (self._current != (artist, album)) or (self._cover_art is not None):
             return
@@ -75,8 +75,10 @@ class SettingsMenu(Gtk.Popover):
         switch_box.pack_end(self._connect_switch, False, False, 0)
         self._grid.attach_next_to(switch_box, self._connect_label,
                                   Gtk.PositionType.RIGHT, 1, 1)
-        self._connect_switch.connect('notify::active',
-                                     self._on_user_connect_change)
+        self._switch_handler = self._connect_switch.connect(
+            'notify::active',
+            self._on_user_connect_change
+        )
 
         self._update_btn = Gtk.Button(label='Update')
         self._update_btn.set_can_focus(False)
@@ -103,7 +105,12 @@ class SettingsMenu(Gtk.Popover):
         self._save()
 
     def _on_mpd_connection(self, _, success):
-        self._connect_switch.set_active(success)
+        # This reflects the connection status; it is not the user
+        # asking to connect or disconnect.
+        with self._connect_switch.handler_block(self._switch_handler):
+            self._connect_switch.set_active(success)
+        self._host_entry.set_editable(not success)
+        self._port_entry.set_editable(not success)
         txt = 'Connected' if success else 'Connect'
         self._connect_label.set_text(txt)
 
@@ -2,6 +2,8 @@ from gi.repository import GdkPixbuf, GObject, Gtk, Pango, GLib, Gdk
 
 import cairo
 
+from ..util.art import ArtPriority
+
 
 def glib_main(func):
     """
@@ -62,13 +64,18 @@ class AlbumArt:
     """
     Asynchronously resolved album artwork. This will initially be a
     pixbuf that is the placeholder image, but will change to the album
-    artwork once that has been loaded.
+    artwork once that has been loaded. If a size is given, a thumbnail
+    of the artwork at that size is loaded rather than the original.
     """
     ScaleMode = GdkPixbuf.InterpType.BILINEAR
 
-    def __init__(self, artcache, album, placeholder_pixbuf):
+    def __init__(self, artcache, album, placeholder_pixbuf, size=None):
         self._art = artcache
         self._album = album
+        self._size = size
+        self._priority = ArtPriority.VISIBLE
+        self._handle = None
+        self._cancelled = False
         self._resolved = None
         self._placeholder = placeholder_pixbuf
 
@@ -79,26 +86,67 @@ class AlbumArt:
         pixbuf = self._resolved if self.is_resolved() else self._placeholder
         return pixbuf.scale_simple(edge_size, edge_size, AlbumArt.ScaleMode)
 
-    def resolve(self, on_done, user_data):
+    def resolve(self, on_done, user_data, priority=ArtPriority.VISIBLE):
         """
         Asychronously resolves and loads the cover artwork file into a
         pixbuf.  Calls the user-supplied callback with the new pixbuf
         when done. The user_data is arbitrary data that will be passed
-        along to the callback.
+        along to the callback. The requests are made with this
+        AlbumArt as their owner, so they can be reprioritized with
+        prioritize().
 
         """
 
         @glib_main
         def _on_art_ready(pixbuf, data):
-            self._resolved = pixbuf
-            on_done(pixbuf, data)
+            self._handle = None
+            if not self._cancelled:
+                self._resolved = pixbuf
+                on_done(pixbuf, data)
 
         @glib_main
         def _on_cover_path(cover_path):
-            if cover_path:
-                self._art.fetch(cover_path, _on_art_ready, user_data)
+            self._handle = None
+            if cover_path and not self._cancelled:
+                self._handle = self._art.fetch(cover_path, _on_art_ready,
+                                               user_data, self._size,
+                                               self._priority, self)
+
+        self._priority = priority
+        if self._size is None:
+            self._handle = self._art.async_resolve_cover_file(
+                self._album.dirpath, _on_cover_path, priority, self)
+        else:
+            self._handle = self._art.async_resolve_thumbnail(
+                self._album.dirpath, self._size, _on_cover_path, priority,
+                self)
+
+    def cancel(self):
+        """
+        Gives up on loading the artwork, if it is still loading. The
+        callback given to resolve() will not be called.
+        """
+        self._cancelled = True
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def prioritize(self, priority):
+        """Moves this artwork's queued requests to the priority."""
+        AlbumArt.prioritize_all([self], priority)
 
-        self._art.async_resolve_cover_file(self._album.dirpath, _on_cover_path)
+    @staticmethod
+    def prioritize_all(album_arts, priority):
+        """
+        Moves the queued requests of many AlbumArts to the priority
+        at once, which is much cheaper than one at a time.
+        """
+        changed = [a for a in album_arts
+                   if not a.is_resolved() and a._priority != priority]
+        for a in changed:
+            a._priority = priority
+        if changed:
+            changed[0]._art.reprioritize(changed, priority)
 
 
 class Scrollable(Gtk.ScrolledWindow):
@@ -176,6 +224,20 @@ class Table:
     def add(self, col_values):
         self._model.append(col_values)
 
+    def set_row(self, index, col_values):
+        """
+        Replaces the row at index, appending rows if the table is
+        not yet that long.
+        """
+        while len(self._model) <= index:
+            self._model.append(col_values)
+        self._model[index] = col_values
+
+    def truncate(self, length):
+        """Removes the rows at positions length and beyond."""
+        while len(self._model) > length:
+            self._model.remove(self._model.get_iter(length))
+
     def as_widget(self):
         self._tree = Gtk.TreeView.new_with_model(self._model)
 
@@ -222,6 +284,42 @@ class BooleanRef:
         return changed
 
 
+def pixbuf_to_surface(pixbuf):
+    """
+    Copies a pixbuf into a new cairo image surface. Unlike
+    Gdk.cairo_surface_create_from_pixbuf(), this doesn't need a
+    window, so it can be used in worker threads.
+    """
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, pixbuf.get_width(),
+                                 pixbuf.get_height())
+    ctx = cairo.Context(surface)
+    Gdk.cairo_set_source_pixbuf(ctx, pixbuf, 0, 0)
+    ctx.paint()
+    return surface
+
+
+def add_surface_border(surface, color, border_width=4, scale=1):
+    """
+    Like add_pixbuf_border(), but for a cairo image surface. The new
+    surface has the device scale given, for HiDPI screens.
+    """
+    w = surface.get_width() + border_width * 2
+    h = surface.get_height() + border_width * 2
+    bordered = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+    ctx = cairo.Context(bordered)
+    ctx.new_path()
+    ctx.rectangle(0, 0, w, h)
+    ctx.close_path()
+    ctx.set_source_surface(surface, border_width, border_width)
+    ctx.clip_preserve()
+    ctx.paint()
+    ctx.set_source_rgba(color.red, color.green, color.blue, color.alpha)
+    ctx.set_line_width(border_width * 2)
+    ctx.stroke()
+    bordered.set_device_scale(scale, scale)
+    return bordered
+
+
 def add_pixbuf_border(pixbuf, color, border_width=4):
     w, h = pixbuf.get_width(), pixbuf.get_height()
     w += border_width * 2
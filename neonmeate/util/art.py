@@ -1,54 +1,43 @@
 import os
 
 import gi
-import logging
+import hashlib
 import heapq
+import itertools
+import logging
+import re
+import threading
 import time
+from collections import OrderedDict
+from functools import partial
+
+import mpd as mpd2
 
 gi.require_version('GdkPixbuf', '2.0')
 
 from gi.repository import GdkPixbuf, Gio, GLib, GObject
-
-
-class PriorityQueue:
-    def __init__(self, key):
-        self._q = []
-        self._key = key
-
-    def add(self, item):
-        t = (self._key(item), item)
-        self._q.append(t)
-        heapq.heappush(self._q, t)
-
-    def __len__(self):
-        return len(self._q)
-
-    def clear(self):
-        self._q.clear()
-
-    def pop_min(self):
-        _, item = heapq.heappop(self._q)
-        return item
-
-    def update(self, item, key_fn):
-        k = key_fn(item)
-        for i, tup in enumerate(self._q):
-            _, elem = tup
-            if key_fn(elem) == k:
-                del self._q[i]
-                break
-        self.add(item)
+from .config import neonmeate_cache_dir
+from .thumbnails import ThumbnailAtlas, ThumbnailStore
 
 
 class LruCoverCache:
-    def __init__(self, max_size):
-        self._max_size = max_size
-        self._q = PriorityQueue(lambda cachekey: cachekey.last_access_time)
-        self._key_by_path = {}
-        self._img_cache = {}
+    """
+    Holds decoded covers, evicting the least recently used ones once
+    their pixel data takes more than max_bytes. A single large cover
+    can take as much memory as hundreds of small ones, so the budget
+    is in bytes rather than entries.
+    """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def __contains__(self, item):
-        return item in self._key_by_path
+        return item in self._entries
 
     def __getitem__(self, item):
         return self.get(item)
@@ -56,158 +45,794 @@ class LruCoverCache:
     def __setitem__(self, key, value):
         self.put(key, value)
 
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def size_of(pixbuf):
+        return pixbuf.get_rowstride() * pixbuf.get_height()
+
     def clear(self):
-        self._key_by_path = {}
-        self._img_cache = {}
-        self._q.clear()
+        self._entries.clear()
+        self._bytes = 0
 
     def get(self, file_path):
-        key = self._key_by_path.get(file_path, None)
-        if key:
-            key.update_access_time()
-            self._q.update(key, lambda cachekey: cachekey.file_path)
-            return self._img_cache[key.file_path]
-        return None
+        entry = self._entries.get(file_path, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(file_path)
+        return entry[0]
 
     def put(self, file_path, pixbuf):
-        while len(self._q) >= self._max_size:
-            self._q.pop_min()
-        key = CacheKey(file_path)
-        self._key_by_path[file_path] = key
-        self._img_cache[file_path] = pixbuf
-        self._q.add(key)
+        self._remove(file_path)
+        size = LruCoverCache.size_of(pixbuf)
+        if size > self._max_bytes:
+            return
+        while self._bytes + size > self._max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+        self._entries[file_path] = (pixbuf, size)
+        self._bytes += size
+
+    def _remove(self, file_path):
+        entry = self._entries.pop(file_path, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self._max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class CoverIndex:
+    """
+    Remembers which file is the cover in each album directory. A
+    directory is read with a single scandir and the file names are
+    matched without regard to case, preferring names that come
+    earlier in the list given. Directories without a cover are
+    remembered too.
+
+    An entry is only trusted while its directory's modification time
+    is unchanged, which adding, removing or renaming a file changes.
+    Checking that costs one stat, rather than one for every name a
+    cover might have.
+
+    Albums split into directories such as CD1 and CD2 usually keep
+    their cover in the parent directory, so that is tried when a disc
+    directory has no cover of its own.
+    """
 
+    DiscDir = re.compile(r'^(cd|dis[ck])\s*\d+$', re.IGNORECASE)
 
-class CacheKey:
-    def __init__(self, file_path):
-        self.file_path = file_path
-        self.last_access_time = time.monotonic_ns()
+    def __init__(self, names):
+        self._rank = {name.lower(): i for i, name in enumerate(names)}
+        # Workers may race to fill in the same directory, which only
+        # costs a repeated scan, so there is no lock.
+        self._entries = {}
 
-    def update_access_time(self):
-        self.last_access_time = time.monotonic_ns()
+    def __len__(self):
+        return len(self._entries)
 
+    def clear(self):
+        self._entries = {}
+
+    def find(self, dirpath):
+        """
+        :param dirpath: full path of an album directory
+        :return: full path of its cover, or None
+        """
+        cover = self._find_in(dirpath)
+        if cover is None and CoverIndex.DiscDir.match(
+                os.path.basename(os.path.normpath(dirpath))):
+            cover = self._find_in(os.path.dirname(os.path.normpath(dirpath)))
+        return cover
+
+    def _find_in(self, dirpath):
+        try:
+            mtime = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            return None
+        entry = self._entries.get(dirpath, None)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+        cover = self._scan(dirpath)
+        self._entries[dirpath] = (mtime, cover)
+        return cover
+
+    def _scan(self, dirpath):
+        best_rank, best = len(self._rank), None
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    rank = self._rank.get(entry.name.lower(), best_rank)
+                    if rank < best_rank and entry.is_file():
+                        best_rank, best = rank, entry.path
+        except OSError:
+            return None
+        return best
 
-# noinspection PyUnresolvedReferences
-class ArtCache(GObject.GObject):
-    """
-    Service for fetching album artwork. This assumes that the
-    album artwork is located in <music_dir>/<artist>/<album>
 
-    This does not use MPD's command for retrieving embedded
-    album art; it assumes the music being played is located
-    on the filesystem and it will read from there.
+class LocalArtSource:
+    """
+    Finds cover artwork in the music directory, for when it is
+    mounted on this machine. The artwork is expected to be a file
+    such as cover.jpg in the album's directory.
     """
 
     CoverNames = [f'{base}.{ext}'
                   for base in ['cover', 'front', 'folder', 'art']
-                  for ext in ['jpg', 'png', 'gif']]
+                  for ext in ['jpg', 'jpeg', 'png', 'gif']]
+
+    def __init__(self, configstate):
+        self._root_music_dir = configstate.get_musicpath()
+        self._index = CoverIndex(LocalArtSource.CoverNames)
+        configstate.connect('notify::musicpath', self._on_music_path)
+
+    def _on_music_path(self, configstate, _):
+        self._root_music_dir = configstate.get_musicpath()
+        self._index.clear()
+
+    def cached_cover(self, dirpath):
+        return self.find_cover(dirpath)
 
-    def __init__(self, configstate, executor):
+    def find_cover(self, dirpath):
+        """
+        :param dirpath: directory relative to music dir
+        :return: full path to the album art file,
+        or None if it could not be found
+        """
+        return self._index.find(os.path.join(self._root_music_dir, dirpath))
+
+    def warm(self, dirpaths):
+        """Indexes the directories ahead of time."""
+        for dirpath in dirpaths:
+            self.find_cover(dirpath)
+
+
+class MpdArtSource:
+    """
+    Downloads cover artwork from the MPD server with the albumart
+    command, falling back to readpicture for art embedded in the
+    songs. This works when the music directory is not mounted here.
+
+    Downloads go over a connection of their own, so that a large
+    image does not hold up the commands that control playback. The
+    images are saved in a cache directory, named after a hash of the
+    server and album directory, so each one is only downloaded once. Albums the
+    server has no art for are remembered for a while too.
+    """
+
+    # How much of an image the server sends per response. MPD's
+    # default is 8 KiB, which takes hundreds of round trips for a
+    # large cover.
+    BinaryLimit = 1024 * 1024
+
+    # Albums without art are asked about again after this long.
+    NoArtSecs = 24 * 60 * 60
+
+    def __init__(self, mpdclient, cache_dir=None):
+        self._mpdclient = mpdclient
+        if cache_dir is None:
+            cache_dir = os.path.join(neonmeate_cache_dir(), 'covers')
+        self._cache_dir = cache_dir
+        self._conn = None
+        self._conn_server = None
+        self._lock = threading.Lock()
+        self._log = logging.getLogger(__name__)
+
+    def _cache_path(self, dirpath):
+        host, port = self._mpdclient.host_and_port()
+        key = f'{host}:{port}/{dirpath}'
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self._cache_dir, name)
+
+    def cached_cover(self, dirpath):
+        """Looks in the cache only; never talks to the server."""
+        path = self._cache_path(dirpath)
+        return path if os.path.exists(path) else None
+
+    def warm(self, dirpaths):
+        # Downloading every cover in the library up front would cost
+        # far more than it saves.
+        pass
+
+    def _known_missing(self, path):
+        marker = path + '.none'
+        try:
+            return time.time() - os.path.getmtime(marker) < self.NoArtSecs
+        except OSError:
+            return False
+
+    def find_cover(self, dirpath):
+        """
+        Returns the path of the cached image for the album directory,
+        downloading it first if needed. Returns None if the server has
+        no art for the album or can't be reached.
+        """
+        path = self._cache_path(dirpath)
+        if os.path.exists(path):
+            return path
+        if self._known_missing(path):
+            return None
+        with self._lock:
+            try:
+                data = self._download(dirpath)
+            except (mpd2.MPDError, OSError) as e:
+                self._log.warning(f'album art download failed: {e}')
+                self._disconnect()
+                return None
+        os.makedirs(self._cache_dir, exist_ok=True)
+        target = path
+        if data is None:
+            target += '.none'
+            data = b''
+        tmp = f'{target}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, target)
+        return path if os.path.exists(path) else None
+
+    def _connection(self):
+        server = self._mpdclient.host_and_port()
+        if self._conn is not None and self._conn_server != server:
+            self._disconnect()
+        if self._conn is None:
+            conn = self._mpdclient.create_connection()
+            try:
+                conn.binarylimit(MpdArtSource.BinaryLimit)
+            except mpd2.CommandError:
+                # Servers older than 0.22.4 don't have binarylimit.
+                pass
+            self._conn = conn
+            self._conn_server = server
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.disconnect()
+            except (mpd2.MPDError, OSError):
+                pass
+            self._conn = None
+            self._conn_server = None
+
+    def _download(self, dirpath):
+        """
+        Returns the image bytes for the album, or None if there are
+        none. python-mpd2 requests the image in chunks, following the
+        offsets until the size the server reported has been read.
+        """
+        conn = self._connection()
+        try:
+            entries = conn.lsinfo(dirpath)
+        except mpd2.CommandError:
+            # The directory is not in the server's database.
+            return None
+        uri = None
+        for entry in entries:
+            if 'file' in entry:
+                uri = entry['file']
+                break
+        if uri is None:
+            return None
+        for command in [conn.albumart, conn.readpicture]:
+            try:
+                reply = command(uri)
+            except mpd2.CommandError:
+                continue
+            if reply and reply.get('binary', None):
+                return reply['binary']
+        return None
+
+
+def art_sources(names, configstate, mpdclient):
+    """
+    Creates the art sources with the names given, which are tried
+    in that order. The names are those of the art_sources setting.
+    """
+    sources = []
+    for name in names:
+        if name == 'local':
+            sources.append(LocalArtSource(configstate))
+        elif name == 'mpd':
+            sources.append(MpdArtSource(mpdclient))
+        else:
+            logging.getLogger(__name__).warning(
+                f'unknown art source: {name}')
+    return sources
+
+
+class ArtPriority:
+    """
+    How urgently a piece of artwork is wanted. Lower values are
+    loaded first.
+    """
+    NOW_PLAYING = 0
+    VISIBLE = 1
+    NEAR = 2
+    SPECULATIVE = 3
+
+    IoPriorities = {
+        NOW_PLAYING: GLib.PRIORITY_HIGH,
+        VISIBLE: GLib.PRIORITY_DEFAULT,
+        NEAR: GLib.PRIORITY_LOW,
+        SPECULATIVE: GLib.PRIORITY_LOW
+    }
+
+
+class ArtJob:
+    """
+    A unit of work for an ArtScheduler. The start function is given
+    a function to call once the work is done, from any thread. The
+    owner is whatever the work is being done for, so that all of its
+    jobs can be reprioritized together.
+    """
+
+    def __init__(self, start, priority, owner=None, cancellable=None):
+        self.start = start
+        self.priority = priority
+        self.owner = owner
+        self.cancellable = cancellable
+        self.started = False
+
+    def is_cancelled(self):
+        return self.cancellable is not None and \
+            self.cancellable.is_cancelled()
+
+
+class ArtScheduler:
+    """
+    Runs jobs in order of priority, and in the order they were
+    submitted within a priority, with no more than max_in_flight of
+    them running at once. Jobs that are still queued can be moved to
+    another priority, e.g. when the artwork they load scrolls out of
+    view. Jobs that are cancelled before they start are skipped.
+    """
+
+    def __init__(self, max_in_flight):
+        self._max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def submit(self, job):
+        with self._lock:
+            heapq.heappush(self._queue, [job.priority, next(self._seq), job])
+        self._run_next()
+
+    def reprioritize(self, owners, priority):
+        """
+        Moves the queued jobs of the owners given to the priority.
+        """
+        owners = set(owners)
+        with self._lock:
+            changed = False
+            for entry in self._queue:
+                job = entry[2]
+                if job.owner in owners and job.priority != priority:
+                    job.priority = entry[0] = priority
+                    changed = True
+            if changed:
+                heapq.heapify(self._queue)
+
+    def raise_priority(self, job, priority):
+        """Moves the job up to the priority if it is still queued."""
+        with self._lock:
+            if job.started or job.priority <= priority:
+                return
+            for entry in self._queue:
+                if entry[2] is job:
+                    job.priority = entry[0] = priority
+                    heapq.heapify(self._queue)
+                    break
+
+    def _run_next(self):
+        while True:
+            with self._lock:
+                if self._in_flight >= self._max_in_flight or \
+                        not self._queue:
+                    return
+                _, _, job = heapq.heappop(self._queue)
+                if job.is_cancelled():
+                    continue
+                job.started = True
+                self._in_flight += 1
+            job.start(self._on_done)
+
+    def _on_done(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._run_next()
+
+
+class ArtHandle:
+    """
+    Returned for a request to ArtCache, so that the caller can give
+    up on it. Work for the request that has not started yet is then
+    skipped, reads and decodes in progress are stopped where
+    possible, and the caller's callback is not called.
+    """
+
+    def __init__(self, on_cancel=None):
+        self.cancellable = Gio.Cancellable()
+        self._on_cancel = on_cancel
+
+    def is_cancelled(self):
+        return self.cancellable.is_cancelled()
+
+    def cancel(self):
+        if not self.cancellable.is_cancelled():
+            self.cancellable.cancel()
+            if self._on_cancel is not None:
+                self._on_cancel()
+
+
+# noinspection PyUnresolvedReferences
+class ArtCache(GObject.GObject):
+    """
+    Service for fetching album artwork. The artwork is looked up by
+    album directory in each of the art sources, in order, until one
+    of them has it.
+
+    Looking up and loading artwork are both scheduled by priority,
+    so that e.g. the cover of the song that is playing is not held
+    up by covers that are only being loaded in case they are needed.
+    Requests can say who they are for (the owner), so that an owner's
+    queued requests can be reprioritized, e.g. when its widget is
+    hidden.
+    """
+
+    # How many lookups and how many loads run at once.
+    MaxResolving = 4
+    MaxLoading = 4
+
+    def __init__(self, configstate, executor, sources,
+                 max_bytes=128 * 2 ** 20):
         self._configstate = configstate
         self._configstate.connect('notify::musicpath', self._on_music_path)
-        self._cache = LruCoverCache(256)
-        self._root_music_dir = configstate.get_musicpath()
+        self._cache = LruCoverCache(max_bytes)
+        self._sources = sources
+        self._thumbnails = ThumbnailStore()
+        self._atlases = {}
+        self._atlases_lock = threading.Lock()
+        # Sizes whose atlas is being opened; only used on the main thread.
+        self._opening_atlases = set()
+        self._checked_tiles = set()
         self._pending_requests = {}
-        self._cover_file_names = ArtCache.CoverNames
         self._thread_pool = executor
+        self._resolving = ArtScheduler(ArtCache.MaxResolving)
+        self._loading = ArtScheduler(ArtCache.MaxLoading)
         self._log = logging.getLogger(__name__)
 
     def _on_music_path(self, configstate, _):
-        self._root_music_dir = configstate.get_musicpath()
         self._cache.clear()
 
-    def async_resolve_cover_file(self, dirpath, on_ready):
-        def runnable():
-            path = self.resolve_cover_file(dirpath)
-            on_ready(path)
+    def stats(self):
+        """Size, hit, miss and eviction counts of the decoded covers."""
+        return self._cache.stats()
+
+    def async_resolve_cover_file(self, dirpath, on_ready,
+                                 priority=ArtPriority.VISIBLE, owner=None):
+        """
+        Finds the artwork for the directory in a worker thread,
+        asking the sources that have to download it if need be. The
+        path to the file, or None, is given to on_ready.
+
+        :return: an ArtHandle for cancelling the request
+        """
+        return self._resolve(self._find_cover, (dirpath,), on_ready,
+                             priority, owner)
+
+    def async_resolve_thumbnail(self, dirpath, size, on_ready,
+                                priority=ArtPriority.VISIBLE, owner=None):
+        """
+        Like async_resolve_cover_file(), but gives on_ready the path
+        of a thumbnail of the artwork that fits in a square of size
+        pixels. The thumbnail is made if it doesn't exist yet.
+
+        :return: an ArtHandle for cancelling the request
+        """
+        return self._resolve(self._resolve_thumbnail, (dirpath, size),
+                             on_ready, priority, owner)
+
+    def _resolve(self, fn, args, on_ready, priority, owner):
+        """
+        Calls fn with args in a worker and gives on_ready the result,
+        unless the request is cancelled first.
+        """
+        handle = ArtHandle()
+
+        def start(done):
+            def run():
+                try:
+                    if handle.is_cancelled():
+                        return
+                    result = fn(*args)
+                    if on_ready is not None and not handle.is_cancelled():
+                        on_ready(result)
+                finally:
+                    done()
+
+            self._thread_pool.execute_async(run)
+
+        self._resolving.submit(ArtJob(start, priority, owner,
+                                      handle.cancellable))
+        return handle
+
+    def reprioritize(self, owners, priority):
+        """
+        Moves the queued requests of the owners to the priority
+        given, e.g. when their artwork scrolls into view.
+        """
+        self._resolving.reprioritize(owners, priority)
+        self._loading.reprioritize(owners, priority)
+
+    def _resolve_thumbnail(self, dirpath, size):
+        """
+        Finds the thumbnail for the album and makes sure the atlas of
+        that size has a tile made from it.
+        """
+        path = self._find_cover(dirpath)
+        atlas = self._atlas(size)
+        if path is None:
+            atlas.forget(dirpath)
+            return None
+        path = self._thumbnails.get(path, size)
+        if path is not None:
+            atlas.add(dirpath, path)
+        return path
+
+    def _atlas(self, size):
+        """
+        Returns the atlas of the size, opening it first if need be.
+        Opening reads its files, so this is for worker threads.
+        """
+        with self._atlases_lock:
+            atlas = self._atlases.get(size, None)
+            if atlas is None:
+                atlas = ThumbnailAtlas(size)
+                self._atlases[size] = atlas
+            return atlas
+
+    def open_atlas(self, size):
+        """Opens the atlas of the size in the background."""
+        if size not in self._atlases and size not in self._opening_atlases:
+            self._opening_atlases.add(size)
+            self._thread_pool.execute_async(self._atlas, size)
+
+    def atlas_tile(self, dirpath, size):
+        """
+        Returns the album's tile from the atlas of that size as a
+        cairo surface, or None if there isn't one yet. This does no
+        file I/O, so it is safe to call on the main thread; if the
+        atlas hasn't been opened yet, None is returned and it is
+        opened in the background.
+
+        The cover may have changed since the tile was made, so the
+        first time a tile is asked for, the cover is checked in a
+        worker and the tile replaced if need be. The new tile is
+        shown the next time the album is rendered.
+        """
+        atlas = self._atlases.get(size, None)
+        if atlas is None:
+            self.open_atlas(size)
+            return None
+        tile = atlas.tile(dirpath)
+        if tile is not None and (dirpath, size) not in self._checked_tiles:
+            self._checked_tiles.add((dirpath, size))
+            self._resolve(self._resolve_thumbnail, (dirpath, size), None,
+                          ArtPriority.SPECULATIVE, None)
+        return tile
+
+    def warm_covers(self, dirpaths):
+        """
+        Looks up the covers of the directories in the background, for
+        the sources that can do so cheaply, so that resolving them
+        later is quick. Sources that would have to download the
+        covers are skipped.
+        """
+        dirpaths = list(dirpaths)
+        for source in self._sources:
+            self._thread_pool.execute_async(source.warm, dirpaths)
+
+    def prefetch(self, dirpaths):
+        """
+        Loads the covers of the directories into the cache in the
+        background. Each directory is only looked up once, however
+        many times it is given, and the covers are loaded in the
+        order of the directories.
+        """
+        dirpaths = list(dict.fromkeys(dirpaths))
+
+        def find_covers():
+            return [p for p in map(self._find_cover, dirpaths) if p]
 
-        self._thread_pool.execute_async(runnable)
+        def on_ready(paths):
+            GLib.idle_add(self._prefetch_paths, paths)
+
+        self._resolve(find_covers, (), on_ready, ArtPriority.SPECULATIVE,
+                      None)
+
+    def _prefetch_paths(self, paths):
+        for path in paths:
+            self.fetch(path, None, None, priority=ArtPriority.SPECULATIVE)
+        return False
+
+    def _find_cover(self, dirpath):
+        for source in self._sources:
+            path = source.find_cover(dirpath)
+            if path is not None:
+                return path
+        return None
 
     def resolve_cover_file(self, dirpath):
         """
-        Locates the cover artwork with the directory path given.
-        Various artwork file name patterns will be tried.
+        Locates the cover artwork with the directory path given,
+        without downloading anything. Artwork that has not been
+        downloaded yet is only found by async_resolve_cover_file().
 
         :param dirpath: directory relative to music dir
         :return: full path to the album art file,
         or None if it could not be found
         """
-        for f in self._cover_file_names:
-            fullpath = os.path.join(self._root_music_dir, dirpath, f)
-            if os.path.exists(fullpath):
-                return fullpath
+        for source in self._sources:
+            path = source.cached_cover(dirpath)
+            if path is not None:
+                return path
         return None
 
-    def fetch(self, file_path, callback, user_data):
+    def fetch(self, file_path, callback, user_data, size=None,
+              priority=ArtPriority.VISIBLE, owner=None):
         """
         Asynchronously loads the image at file_path
         and provides it to the callback as a GdkPixbuf
         instance.
 
+        If size is given, the image is decoded to fit within a square
+        of that many pixels, keeping its aspect ratio. For JPEGs this
+        is done while decoding, which is far cheaper than decoding a
+        large cover at full size and scaling it down afterwards. Each
+        size is cached separately.
+
         The caller can also supply arbitrary data for the
         user_data parameter and that will be given to the
         callback as well.
+
+        :return: an ArtHandle for cancelling the request. The image
+        is only loaded if someone who asked for it still wants it.
         """
-        if file_path in self._cache:
+        key = (file_path, size)
+        pixbuf = self._cache.get(key)
+        if pixbuf is not None:
             if callback is not None:
-                callback(self._cache[file_path], user_data)
-            return
-        req = self._get_pending_or_create(file_path, callback, user_data)
-        gio_file = Gio.File.new_for_path(file_path)
+                callback(pixbuf, user_data)
+            return ArtHandle()
+        req = self._pending_requests.get(key, None)
+        if req is None:
+            req = ArtRequest(file_path, size)
+            self._pending_requests[key] = req
+            req.job = ArtJob(partial(self._start_read, req), priority, owner,
+                             req.cancellable)
+            self._loading.submit(req.job)
+        else:
+            self._loading.raise_priority(req.job, priority)
+        entry = req.add_callback(callback, user_data)
+        return ArtHandle(partial(self._withdraw, req, entry))
+
+    def _withdraw(self, art_request, entry):
+        if art_request.remove_callback(entry):
+            art_request.cancellable.cancel()
+            self._forget_request(art_request)
+
+    def _forget_request(self, art_request):
+        key = art_request.key()
+        if self._pending_requests.get(key, None) is art_request:
+            del self._pending_requests[key]
+
+    def _start_read(self, art_request, done):
+        art_request.done = done
+        gio_file = Gio.File.new_for_path(art_request.file_path)
         gio_file.read_async(
-            GLib.PRIORITY_DEFAULT,
-            None,
+            ArtPriority.IoPriorities[art_request.job.priority],
+            art_request.cancellable,
             self._on_stream_ready,
-            req
+            art_request
         )
 
-    def _get_pending_or_create(self, file_path, callback, user_data):
-        """
-        Returns an ArtRequest for the path. If there is already
-        one pending, then it will be returned. Otherwise, creates
-        a new one.
-        """
-        if file_path in self._pending_requests:
-            r = self._pending_requests[file_path]
-            r.add_callback(callback, user_data)
-        else:
-            r = ArtRequest(file_path, callback, user_data)
-            self._pending_requests[file_path] = r
-        return r
+    def _on_failure(self, art_request, action, e):
+        if not e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+            self._log.error(f'{action} failed for '
+                            f'{art_request.file_path}: {e.message}')
+        self._forget_request(art_request)
+        art_request.done()
 
     def _on_stream_ready(self, src_object, result, art_request):
         try:
             stream = src_object.read_finish(result)
         except GLib.GError as e:
-            self._log.error(f'stream finish failed: {e.message}', e)
+            self._on_failure(art_request, 'reading', e)
+            return
+        if art_request.size is None:
+            GdkPixbuf.Pixbuf.new_from_stream_async(
+                stream, art_request.cancellable, self._on_pixbuf_ready,
+                art_request)
         else:
-            GdkPixbuf.Pixbuf.new_from_stream_async(stream, None,
-                                                   self._on_pixbuf_ready,
-                                                   art_request)
+            GdkPixbuf.Pixbuf.new_from_stream_at_scale_async(
+                stream, art_request.size, art_request.size, True,
+                art_request.cancellable, self._on_pixbuf_ready, art_request)
 
     def _on_pixbuf_ready(self, src_object, result, art_request):
-        pixbuf = GdkPixbuf.Pixbuf.new_from_stream_finish(result)
-        self._cache[art_request.file_path] = pixbuf
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_stream_finish(result)
+        except GLib.GError as e:
+            self._on_failure(art_request, 'decoding', e)
+            return
+        art_request.done()
+        self._forget_request(art_request)
+        if art_request.cancellable.is_cancelled():
+            return
+        self._cache[art_request.key()] = pixbuf
         art_request.on_completion(pixbuf)
-        if art_request.file_path in self._pending_requests:
-            del self._pending_requests[art_request.file_path]
 
 
 class ArtRequest:
     """
-    A request to fetch an image file. Once the file has
+    A request to fetch an image file, decoded to fit the size
+    given or at full size if that is None. Once the file has
     been loaded, the associated callbacks will be called
     on the GTK main thread.
+
+    Everyone who asks for the image while it is pending shares the
+    request. It is cancelled once all of them have withdrawn.
     """
 
-    def __init__(self, file_path, callback, user_data):
+    def __init__(self, file_path, size):
         self.file_path = file_path
+        self.size = size
+        self.job = None
+        self.done = None
+        self.cancellable = Gio.Cancellable()
         self._callbacks = []
-        self.add_callback(callback, user_data)
+        self._interest = 0
+
+    def key(self):
+        return self.file_path, self.size
 
     def add_callback(self, callback, user_data):
+        """
+        Registers interest in the request, returning an entry that
+        can be given to remove_callback().
+        """
+        self._interest += 1
+        entry = (callback, user_data)
         if callback is not None:
-            self._callbacks.append((callback, user_data))
+            self._callbacks.append(entry)
+        return entry
+
+    def remove_callback(self, entry):
+        """
+        Withdraws interest in the request. Returns True if nobody is
+        interested any more.
+        """
+        self._interest -= 1
+        for i, e in enumerate(self._callbacks):
+            if e is entry:
+                del self._callbacks[i]
+                break
+        return self._interest <= 0
 
     def on_completion(self, art):
         for callback, user_data in self._callbacks:
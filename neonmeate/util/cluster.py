@@ -1,3 +1,6 @@
+import bisect
+import itertools
+import math
 import random
 import sys
 
@@ -5,20 +8,114 @@ from gi.repository import GdkPixbuf
 
 from neonmeate.util.color import RGBColor
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def triplet_mean(elements):
-    n = len(elements)
+
+def triplet_mean(elements, weights=None):
+    if weights is None:
+        weights = [1] * len(elements)
+
+    n = sum(weights)
 
     if n == 0:
         return 0, 0, 0
 
-    a = sum(x for x, _, _ in elements)
-    b = sum(y for _, y, _ in elements)
-    c = sum(z for _, _, z in elements)
+    a = sum(x * w for (x, _, _), w in zip(elements, weights))
+    b = sum(y * w for (_, y, _), w in zip(elements, weights))
+    c = sum(z * w for (_, _, z), w in zip(elements, weights))
 
     return a / n, b / n, c / n
 
 
+# The number of pixels k-means++ picks its initial centroids from.
+SeedSampleSize = 1000
+
+
+def kmeans_plusplus(colors, k, rng, squared_distance, weights=None):
+    """
+    Picks up to k of the colors as initial centroids with k-means++:
+    the first at random, and each next one at random with a
+    probability proportional to its squared distance from the
+    nearest centroid picked so far, times its weight if there are
+    weights. Stops early if every color is already a centroid.
+    """
+    if weights is None:
+        weights = [1] * len(colors)
+    first = rng.choices(colors, weights)[0]
+    centroids = [first]
+    nearest = [squared_distance(*c, *first) for c in colors]
+    while len(centroids) < k:
+        cumulative = list(itertools.accumulate(
+            d * w for d, w in zip(nearest, weights)))
+        if cumulative[-1] <= 0:
+            break
+        i = bisect.bisect_right(cumulative, rng.random() * cumulative[-1])
+        chosen = colors[min(i, len(colors) - 1)]
+        centroids.append(chosen)
+        nearest = [min(d, squared_distance(*c, *chosen))
+                   for c, d in zip(colors, nearest)]
+    return centroids
+
+
+def farthest_first(colors, k, rng, distance):
+    """
+    Picks up to k of the colors as initial centroids: the first at
+    random, and each next one the color farthest from the nearest
+    centroid picked so far.
+    """
+    centroids = [rng.choice(colors)]
+    nearest = [distance(*c, *centroids[0]) for c in colors]
+    while len(centroids) < min(k, len(colors)):
+        i = max(range(len(colors)), key=nearest.__getitem__)
+        chosen = colors[i]
+        centroids.append(chosen)
+        nearest = [min(d, distance(*c, *chosen))
+                   for c, d in zip(colors, nearest)]
+    return centroids
+
+
+# Bits kept of each channel when colors are counted in a histogram;
+# 5 bits gives 32768 bins.
+HistogramBits = 5
+
+
+def histogram_bin(r, g, b, bits=HistogramBits):
+    shift = 8 - bits
+    return (r >> shift) << (2 * bits) | (g >> shift) << bits | b >> shift
+
+
+def color_histogram(img, bits=HistogramBits):
+    """
+    Counts the image's colors in one pass over its bytes, with each
+    channel quantized to the given number of bits. Returns a dict
+    from each bin that isn't empty to [count, red sum, green sum,
+    blue sum], so that the mean color of each bin is known as well
+    as its size.
+    """
+    shift = 8 - bits
+    data = img.bytes
+    step = img.channels
+    bins = {}
+    for y in range(img.height):
+        start = y * img.stride
+        for p in range(start, start + img.width * step, step):
+            r, g, b = data[p], data[p + 1], data[p + 2]
+            key = (r >> shift) << (2 * bits) | (g >> shift) << bits | \
+                b >> shift
+            entry = bins.get(key, None)
+            if entry is None:
+                bins[key] = [1, r, g, b]
+            else:
+                entry[0] += 1
+                entry[1] += r
+                entry[2] += g
+                entry[3] += b
+    return bins
+
+
 def pixbuf_from_file(fileobj):
     pixbuf = GdkPixbuf.Pixbuf.new_from_file(fileobj.name)
     return pixbuf
@@ -30,23 +127,25 @@ class Image:
         self.width = pixbuf.get_width()
         self.height = pixbuf.get_height()
         self.stride = pixbuf.get_rowstride()
+        self.channels = pixbuf.get_n_channels()
         self.bytes = pixbuf.get_pixels()
 
     def color(self, row, col):
-        p = row * self.stride + col * 3
+        p = row * self.stride + col * self.channels
         return self.bytes[p], self.bytes[p + 1], self.bytes[p + 2]
 
 
 class Cluster:
 
-    def __init__(self, label, initial_value, mean_fn, colorspace):
+    def __init__(self, label, initial_value, mean_fn, colorspace, count=0):
         self._colorspace = colorspace
         self.label = label
         self.dist_fn = colorspace.distance
         self.mean_fn = mean_fn
         self._centroid = initial_value
         self.elements = []
-        self._count = 0
+        self.weights = []
+        self._count = count
 
     def count(self):
         return self._count
@@ -60,15 +159,17 @@ class Cluster:
 
     def recalc_centroid(self):
         if self.elements:
-            self._count = len(self.elements)
+            self._count = sum(self.weights)
             self._centroid = self._mean()
             self.elements = []
+            self.weights = []
 
     def _mean(self):
-        return self.mean_fn(self.elements)
+        return self.mean_fn(self.elements, self.weights)
 
-    def add(self, element):
+    def add(self, element, weight=1):
         self.elements.append(element)
+        self.weights.append(weight)
 
     def similar(self, clust2, threshold=0.01):
         dm = clust2.centroid()
@@ -81,6 +182,10 @@ class RGBColorSpace:
     def distance(r1, g1, b1, r2, g2, b2):
         return RGBColor.rgb_euclidean_dist(r1, g1, b1, r2, g2, b2)
 
+    @staticmethod
+    def squared_distance(r1, g1, b1, r2, g2, b2):
+        return (r1 - r2) ** 2 + (g1 - g2) ** 2 + (b1 - b2) ** 2
+
     @staticmethod
     def as_3_tuple(rgbcolor):
         return rgbcolor.components()
@@ -93,6 +198,14 @@ class RGBColorSpace:
     def to_rgbcolor(a, b, c):
         return RGBColor(a, b, c)
 
+    @staticmethod
+    def as_3_array(rgb):
+        return rgb
+
+    @staticmethod
+    def coordinates(colors):
+        return colors
+
 
 class HSVColorSpace:
 
@@ -100,6 +213,11 @@ class HSVColorSpace:
     def distance(h1, s1, v1, h2, s2, v2):
         return RGBColor.norm_hsv_dist(h1, s1, v1, h2, s2, v2)
 
+    @staticmethod
+    def squared_distance(h1, s1, v1, h2, s2, v2):
+        # norm_hsv_dist is already the squared distance in the cone.
+        return RGBColor.norm_hsv_dist(h1, s1, v1, h2, s2, v2)
+
     @staticmethod
     def as_3_tuple(rgbcolor):
         return rgbcolor.to_norm_hsv()
@@ -112,6 +230,30 @@ class HSVColorSpace:
     def to_rgbcolor(a, b, c):
         return RGBColor.from_hsv(a, b, c)
 
+    @staticmethod
+    def as_3_array(rgb):
+        # The same conversion as colorsys.rgb_to_hsv, for an array of
+        # colors at once.
+        r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+        v = rgb.max(axis=1)
+        c = v - rgb.min(axis=1)
+        nonzero_c = numpy.where(c > 0, c, 1.0)
+        s = numpy.where(v > 0, c / numpy.where(v > 0, v, 1.0), 0.0)
+        rc, gc, bc = [(v - x) / nonzero_c for x in (r, g, b)]
+        h = numpy.where(r == v, bc - gc,
+                        numpy.where(g == v, 2.0 + rc - bc, 4.0 + gc - rc))
+        h = numpy.where(c > 0, (h / 6.0) % 1.0, 0.0)
+        return numpy.stack([RGBColor.TwoPi * h, s, v], axis=1)
+
+    @staticmethod
+    def coordinates(colors):
+        # Points in the HSV cone; the squared euclidean distance between
+        # two of them is HSVColorSpace.distance.
+        h, s, v = colors[:, 0], colors[:, 1], colors[:, 2]
+        sv = s * v
+        return numpy.stack([numpy.sin(h) * sv, numpy.cos(h) * sv, 2.0 * v],
+                           axis=1)
+
 
 class ColorClusterer:
 
@@ -120,18 +262,54 @@ class ColorClusterer:
         rgbcolor = RGBColor.from_256(*img.color(y, x))
         return colorspace.as_3_tuple(rgbcolor)
 
-    def __init__(self, num_clusters, cluster_threshold, rng, max_iters, space):
+    def __init__(self, num_clusters, cluster_threshold, rng, max_iters, space,
+                 init='kmeans++', mode='pixels'):
         self._k = num_clusters
         self._max_iters = max_iters
         self._max_init_cluster_iterations = 100
         self._cluster_threshold = cluster_threshold
         self._colorspace = space
         self._rng = rng
+        self._init = init
+        self._mode = mode
+        self._img = None
         self.rounds = []
         self.clusters = []
         self.cluster_assignments = {}
 
     def _init_clusters(self, img):
+        if self._init == 'farthest':
+            self._init_farthest(img)
+        else:
+            self._init_plusplus(img)
+
+    def _init_weighted(self, colors, weights):
+        if self._init == 'farthest':
+            seeds = farthest_first(colors, self._k, self._rng,
+                                   self._colorspace.distance)
+        else:
+            seeds = kmeans_plusplus(colors, self._k, self._rng,
+                                    self._colorspace.squared_distance,
+                                    weights)
+        for i, color in enumerate(seeds):
+            self.clusters.append(Cluster(f'Cluster {i}', color, triplet_mean,
+                                         self._colorspace))
+
+    def _init_plusplus(self, img):
+        n = img.width * img.height
+        # Pixels are numbered in row order, as in NumpyColorClusterer,
+        # so that both pick the same seeds from the same rng.
+        sample = [(i % img.width, i // img.width)
+                  for i in self._rng.sample(range(n), min(n, SeedSampleSize))]
+        colors = [ColorClusterer.color_at(img, x, y, self._colorspace)
+                  for x, y in sample]
+        seeds = kmeans_plusplus(colors, self._k, self._rng,
+                                self._colorspace.squared_distance)
+        for i, color in enumerate(seeds):
+            self.clusters.append(Cluster(f'Cluster {i}', color, triplet_mean,
+                                         self._colorspace))
+
+    def _init_farthest(self, img):
         def getcolor(px, py):
             return ColorClusterer.color_at(img, px, py, self._colorspace)
 
@@ -191,9 +369,9 @@ class ColorClusterer:
 
         return n
 
-    def _add_to_nearest(self, color):
+    def _add_to_nearest(self, color, weight=1):
         near = self._nearest_cluster(color)
-        near.add(color)
+        near.add(color, weight)
         return near
 
     def _merge_similar(self):
@@ -210,13 +388,18 @@ class ColorClusterer:
                 merged_any = True
 
     def _merge_clusters(self, clusters):
+        # Each centroid is weighted by its cluster's count, as in
+        # NumpyColorClusterer._merge, so the merged cluster counts the
+        # pixels of all of them.
         merged = clusters[0]
         to_prune = clusters[1:]
+        if sum(c.count() for c in clusters) > 0:
+            for c in clusters:
+                merged.add(c.centroid(), c.count())
         for c in to_prune:
-            merged.add(c.centroid())
-            for (x, y), cl in self.cluster_assignments.items():
+            for key, cl in self.cluster_assignments.items():
                 if cl == c:
-                    self.cluster_assignments[(x, y)] = merged
+                    self.cluster_assignments[key] = merged
         self.clusters = [c for c in self.clusters if c not in to_prune]
         merged.recalc_centroid()
 
@@ -224,8 +407,21 @@ class ColorClusterer:
         for c in self.clusters:
             c.recalc_centroid()
 
+    def cluster_at(self, x, y):
+        if self._mode == 'histogram':
+            key = histogram_bin(*self._img.color(y, x))
+            return self.cluster_assignments[key]
+        return self.cluster_assignments[(x, y)]
+
     def cluster(self, img):
-        self._init_clusters(img)
+        self._img = img
+        if self._mode == 'histogram':
+            points = self._histogram_points(img)
+            self._init_weighted([c for _, c, _ in points],
+                                [w for _, _, w in points])
+        else:
+            points = None
+            self._init_clusters(img)
         if len(self.clusters) < 2:
             return
 
@@ -239,10 +435,15 @@ class ColorClusterer:
                          self.clusters]
             self.rounds.append(iteration)
 
-            for x, y, components in ColorClusterer.each_img_color(img,
-                                                                  self._colorspace):
-                c = self._add_to_nearest(components)
-                self.cluster_assignments[(x, y)] = c
+            if points is None:
+                for x, y, components in ColorClusterer.each_img_color(
+                        img, self._colorspace):
+                    c = self._add_to_nearest(components)
+                    self.cluster_assignments[(x, y)] = c
+            else:
+                for key, components, weight in points:
+                    c = self._add_to_nearest(components, weight)
+                    self.cluster_assignments[key] = c
 
             self._recalc_centroids()
             self._merge_similar()
@@ -257,6 +458,265 @@ class ColorClusterer:
 
             itercount += 1
 
+    def _histogram_points(self, img):
+        """
+        Returns (bin, mean color, pixel count) for each bin of the
+        image's color histogram that isn't empty, in bin order as
+        NumpyColorClusterer has them.
+        """
+        points = []
+        for key, (n, r, g, b) in sorted(color_histogram(img).items()):
+            color = RGBColor.from_256(r / n, g / n, b / n)
+            points.append((key, self._colorspace.as_3_tuple(color), n))
+        return points
+
+
+class NumpyColorClusterer:
+    """
+    Does the same k-means as ColorClusterer, with the image's colors
+    held in a numpy array so that each round is a few vectorized
+    operations rather than Python work for every pixel and cluster.
+
+    Pixels are assigned by the squared euclidean distance between
+    their coordinates in the color space, which picks the same nearest
+    cluster as the color space's distance function. Centroids are the
+    means of the colors, as triplet_mean computes them, and the result
+    is a list of Cluster objects just like ColorClusterer's.
+
+    In histogram mode the points clustered are the bins of the image's
+    color histogram, weighted by their pixel counts, as in
+    ColorClusterer.
+
+    Only available when numpy is installed.
+    """
+
+    def __init__(self, num_clusters, cluster_threshold, rng, max_iters, space,
+                 init='kmeans++', mode='pixels'):
+        self._k = num_clusters
+        self._max_iters = max_iters
+        self._cluster_threshold = cluster_threshold
+        self._colorspace = space
+        self._rng = rng
+        self._init = init
+        self._mode = mode
+        self._width = 0
+        self._labels = None
+        self._pixel_bins = None
+        self.rounds = []
+        self.clusters = []
+
+    @staticmethod
+    def image_rgb(img):
+        """
+        Returns the image's pixels as an (N, 3) array of bytes, in row
+        order.
+        """
+        pixels = numpy.frombuffer(img.bytes, dtype=numpy.uint8)
+        # A view that skips the row padding and any alpha channel; the
+        # last row isn't padded, which this never reads past.
+        rgb = numpy.lib.stride_tricks.as_strided(
+            pixels, shape=(img.height, img.width, 3),
+            strides=(img.stride, img.channels, 1), writeable=False)
+        return rgb.reshape(-1, 3)
+
+    @staticmethod
+    def image_colors(img, colorspace):
+        """
+        Returns the image's colors as an (N, 3) array in the color
+        space, in row order.
+        """
+        rgb = NumpyColorClusterer.image_rgb(img) / 255.0
+        return colorspace.as_3_array(rgb)
+
+    @staticmethod
+    def image_histogram(img, colorspace, bits=HistogramBits):
+        """
+        The numpy counterpart of color_histogram. Returns the mean
+        color of each bin that isn't empty, in the color space, the
+        bins' pixel counts, and the index of each pixel's bin in those.
+        """
+        rgb = NumpyColorClusterer.image_rgb(img)
+        quantized = (rgb >> (8 - bits)).astype(numpy.intp)
+        keys = quantized[:, 0] << (2 * bits) | \
+            quantized[:, 1] << bits | quantized[:, 2]
+        bins = 1 << (3 * bits)
+        counts = numpy.bincount(keys, minlength=bins)
+        occupied = numpy.flatnonzero(counts)
+        sums = numpy.stack([numpy.bincount(keys, rgb[:, i], bins)[occupied]
+                            for i in range(3)], axis=1)
+        weights = counts[occupied].astype(float)
+        means = sums / weights[:, numpy.newaxis] / 255.0
+        pixel_bins = numpy.searchsorted(occupied, keys)
+        return colorspace.as_3_array(means), weights, pixel_bins
+
+    def cluster(self, img):
+        self._width = img.width
+        if self._mode == 'histogram':
+            colors, weights, self._pixel_bins = \
+                NumpyColorClusterer.image_histogram(img, self._colorspace)
+        else:
+            colors = NumpyColorClusterer.image_colors(img, self._colorspace)
+            weights = None
+        if len(colors) == 0:
+            return
+        centroids, counts, labels = self._kmeans(colors, weights)
+        # A cluster left empty kept a centroid that may not be a color
+        # in the image at all; like ColorClusterer, leave it out.
+        occupied = counts > 0
+        renumbered = numpy.cumsum(occupied) - 1
+        centroids, counts = centroids[occupied], counts[occupied]
+        self._labels = renumbered[labels]
+        self.clusters = [
+            Cluster(f'Cluster {i}', tuple(float(x) for x in centroid),
+                    triplet_mean, self._colorspace, int(count))
+            for i, (centroid, count) in enumerate(zip(centroids, counts))
+        ]
+
+    def cluster_at(self, x, y):
+        i = y * self._width + x
+        if self._pixel_bins is not None:
+            i = self._pixel_bins[i]
+        return self.clusters[self._labels[i]]
+
+    def _kmeans(self, colors, weights):
+        space = self._colorspace
+        coords = space.coordinates(colors)
+        centroids = self._init_centroids(colors, coords, weights)
+        counts = numpy.zeros(len(centroids))
+        labels = numpy.zeros(len(colors), dtype=numpy.intp)
+        thresh = 0.01
+
+        for _ in range(self._max_iters):
+            self.rounds.append([space.to_rgbcolor(*c) for c in centroids])
+            labels = NumpyColorClusterer._nearest(
+                coords, space.coordinates(centroids))
+            means, counts = NumpyColorClusterer._means(
+                colors, labels, centroids, weights)
+            means, counts, mapping = self._merge_similar(means, counts)
+
+            if mapping is not None:
+                labels = mapping[labels]
+            elif all(space.distance(*u, *v) < thresh
+                     for u, v in zip(centroids, means)):
+                centroids = means
+                break
+            centroids = means
+
+        return centroids, counts, labels
+
+    def _init_centroids(self, colors, coords, weights):
+        if self._init == 'farthest':
+            return self._init_farthest(colors, coords)
+        return self._init_plusplus(colors, coords, weights)
+
+    def _pick(self, weights):
+        """Returns an index picked with probability by weight."""
+        cumulative = numpy.cumsum(weights)
+        if cumulative[-1] <= 0:
+            return None
+        p = int(numpy.searchsorted(cumulative,
+                                   self._rng.random() * cumulative[-1],
+                                   side='right'))
+        return min(p, len(weights) - 1)
+
+    def _init_plusplus(self, colors, coords, weights):
+        # kmeans_plusplus with the squared distances to the nearest
+        # centroid kept in an array. Pixels are sampled; histogram bins
+        # are few enough to use them all, weighted by their counts.
+        n = len(colors)
+        if weights is None:
+            sample = numpy.array(self._rng.sample(range(n),
+                                                  min(n, SeedSampleSize)))
+            weights = numpy.ones(len(sample))
+        else:
+            sample = numpy.arange(n)
+        coords = coords[sample]
+        chosen = [self._pick(weights)]
+        nearest = ((coords - coords[chosen[0]]) ** 2).sum(axis=1)
+        while len(chosen) < self._k:
+            p = self._pick(nearest * weights)
+            if p is None:
+                break
+            chosen.append(p)
+            nearest = numpy.minimum(nearest,
+                                    ((coords - coords[p]) ** 2).sum(axis=1))
+        return colors[sample[chosen]]
+
+    def _init_farthest(self, colors, coords):
+        # ColorClusterer's initialization, vectorized: start from a
+        # random pixel and keep adding the pixel that is farthest
+        # from its nearest centroid.
+        chosen = [self._rng.randrange(len(colors))]
+        nearest = ((coords - coords[chosen[0]]) ** 2).sum(axis=1)
+        while len(chosen) < min(self._k, len(colors)):
+            p = int(nearest.argmax())
+            chosen.append(p)
+            nearest = numpy.minimum(nearest,
+                                    ((coords - coords[p]) ** 2).sum(axis=1))
+        return colors[chosen]
+
+    @staticmethod
+    def _nearest(coords, centroid_coords):
+        # |x - c|^2 = |x|^2 - 2x.c + |c|^2, and |x|^2 is the same for
+        # every cluster so it can be left out of the comparison.
+        d = (centroid_coords ** 2).sum(axis=1) - \
+            2.0 * coords @ centroid_coords.T
+        return d.argmin(axis=1)
+
+    @staticmethod
+    def _means(colors, labels, centroids, weights=None):
+        """
+        Returns the mean color of each cluster and its size, which is
+        its total weight if there are weights. A cluster that was left
+        empty keeps its centroid.
+        """
+        k = len(centroids)
+        if weights is None:
+            counts = numpy.bincount(labels, minlength=k).astype(float)
+            weighted = colors
+        else:
+            counts = numpy.bincount(labels, weights, k)
+            weighted = colors * weights[:, numpy.newaxis]
+        sums = numpy.stack([numpy.bincount(labels, weighted[:, i], k)
+                            for i in range(3)], axis=1)
+        means = centroids.copy()
+        occupied = counts > 0
+        means[occupied] = sums[occupied] / counts[occupied, numpy.newaxis]
+        return means, counts
+
+    def _merge_similar(self, centroids, counts):
+        """
+        Merges each cluster into the first earlier one that is within
+        the cluster threshold. Returns the new centroids, the new
+        counts, and an array mapping old cluster indexes to new ones,
+        which is None if nothing was merged.
+        """
+        dist = self._colorspace.distance
+        kept = []
+        target = []
+        for i, c in enumerate(centroids):
+            for n, j in enumerate(kept):
+                if dist(*c, *centroids[j]) < self._cluster_threshold:
+                    target.append(n)
+                    break
+            else:
+                target.append(len(kept))
+                kept.append(i)
+
+        if len(kept) == len(centroids):
+            return centroids, counts, None
+
+        mapping = numpy.array(target)
+        merged_counts = numpy.bincount(mapping, counts, len(kept))
+        sums = numpy.stack([numpy.bincount(mapping, centroids[:, i] * counts,
+                                           len(kept)) for i in range(3)],
+                           axis=1)
+        merged = centroids[kept]
+        occupied = merged_counts > 0
+        merged[occupied] = \
+            sums[occupied] / merged_counts[occupied, numpy.newaxis]
+        return merged, merged_counts, mapping
+
 
 def output(imgpath, clusters, rounds, colorspace):
     s = f"""
@@ -300,18 +760,72 @@ def space_for(space):
     return RGBColorSpace if space == 'rgb' else HSVColorSpace
 
 
+# The number of pixels the numpy engine scales images down to.
+PixelBudget = 200 * 200
+
+# Ways of picking the initial centroids.
+Inits = ['kmeans++', 'farthest']
+
+# What is clustered: every pixel, or the bins of a color histogram.
+Modes = ['pixels', 'histogram']
+
+
+def default_engine():
+    return 'numpy' if numpy is not None else 'python'
+
+
 def clusterize(pixbuf, rng, percent=25, k=7, cluster_thresh=0.6, max_iters=200,
-               space='hsv'):
+               space='hsv', engine=None, max_pixels=PixelBudget,
+               init='kmeans++', mode='pixels'):
+    """
+    Finds the main colors of the image with k-means. The engine is
+    'python' or 'numpy'; by default numpy is used if it is installed.
+    The python engine scales large images to the given percentage of
+    their size, while the numpy engine scales any image down to at
+    most max_pixels pixels.
+
+    The initial centroids are picked with k-means++ from a sample of
+    the pixels, or with init='farthest', by repeatedly taking the
+    pixel farthest from the centroids so far, which scans the whole
+    image for every centroid.
+
+    With mode='histogram', the image's colors are first counted in a
+    histogram with 5 bits per channel, and the bins that aren't empty
+    are clustered, weighted by their counts, instead of the pixels.
+    Covers have few distinct colors once quantized, so this does far
+    less work for much the same palette.
+
+    Returns the clusterer, the Image that was clustered, the clusters
+    sorted from largest to smallest, and the centroids of each round.
+    """
     assert pixbuf.get_bits_per_sample() == 8
     assert pixbuf.get_colorspace() == GdkPixbuf.Colorspace.RGB
 
-    if pixbuf.get_height() > 200 and pixbuf.get_width() > 200:
-        sw, sh = scale_dimensions(pixbuf, percent)
-        pixbuf = pixbuf.scale_simple(sw, sh, GdkPixbuf.InterpType.BILINEAR)
+    if engine is None:
+        engine = default_engine()
+    if init not in Inits:
+        raise ValueError(f'unknown initialization: {init}')
+    if mode not in Modes:
+        raise ValueError(f'unknown clustering mode: {mode}')
+
+    if engine == 'numpy':
+        if numpy is None:
+            raise ValueError('the numpy engine needs numpy to be installed')
+        pixbuf = scale_to_budget(pixbuf, max_pixels)
+        clusterer_type = NumpyColorClusterer
+    elif engine == 'python':
+        if pixbuf.get_height() > 200 and pixbuf.get_width() > 200:
+            sw, sh = scale_dimensions(pixbuf, percent)
+            pixbuf = pixbuf.scale_simple(sw, sh,
+                                         GdkPixbuf.InterpType.BILINEAR)
+        clusterer_type = ColorClusterer
+    else:
+        raise ValueError(f'unknown clustering engine: {engine}')
 
     img = Image(pixbuf)
     color_space = space_for(space)
-    clusterer = ColorClusterer(k, cluster_thresh, rng, max_iters, color_space)
+    clusterer = clusterer_type(k, cluster_thresh, rng, max_iters, color_space,
+                               init, mode)
     clusterer.cluster(img)
     clusters = clusterer.clusters
 
@@ -360,6 +874,33 @@ def scale_dimensions(pixbuf, percentage):
     return new_width, new_height
 
 
+def scale_to_budget(pixbuf, max_pixels):
+    width, height = pixbuf.get_width(), pixbuf.get_height()
+    if width * height <= max_pixels:
+        return pixbuf
+    factor = math.sqrt(max_pixels / (width * height))
+    return pixbuf.scale_simple(max(1, int(width * factor)),
+                               max(1, int(height * factor)),
+                               GdkPixbuf.InterpType.BILINEAR)
+
+
+def mean_distance(clusterer, img):
+    """
+    The mean distance from each pixel to the centroid of its cluster,
+    as a measure of how well the clusters fit the image; lower is
+    better.
+    """
+    space = clusterer._colorspace
+    if not clusterer.clusters:
+        return float('nan')
+    total = 0
+    for y in range(img.height):
+        for x in range(img.width):
+            color = ColorClusterer.color_at(img, x, y, space)
+            total += clusterer.cluster_at(x, y).distance(color)
+    return total / (img.width * img.height)
+
+
 def main(args):
     from PIL import Image
     import argparse
@@ -378,6 +919,17 @@ def main(args):
                         default=100, type=int)
     parser.add_argument('-s', '--space', help='color space for distance',
                         choices=['rgb', 'hsv'], default='hsv')
+    parser.add_argument('-e', '--engine', help='k-means implementation',
+                        choices=['python', 'numpy'], default=default_engine())
+    parser.add_argument('-b', '--budget', help='pixels for the numpy engine',
+                        default=PixelBudget, type=int)
+    parser.add_argument('--init', help='initial centroid selection',
+                        choices=Inits, default='kmeans++')
+    parser.add_argument('-m', '--mode', help='what to cluster',
+                        choices=Modes, default='pixels')
+    parser.add_argument('--compare',
+                        help='compare the initializations and modes',
+                        action='store_true')
     parsed = parser.parse_args(args)
 
     if parsed.pct < 0 or parsed.pct > 100:
@@ -386,13 +938,31 @@ def main(args):
     with open(parsed.file, 'rb') as f:
         pixbuf = pixbuf_from_file(f)
 
-    scaled_width, scaled_height = scale_dimensions(pixbuf, parsed.pct)
-    rng = random.Random()
-    rng.seed(int(1000 * time.time()))
-
-    clusterer, pixbuf_img, clusters, rounds = \
-        clusterize(pixbuf, rng, parsed.pct, parsed.k, parsed.thresh,
-                   parsed.iters, parsed.space)
+    seed = int(1000 * time.time())
+
+    def run(init, mode):
+        start = time.perf_counter()
+        result = clusterize(pixbuf, random.Random(seed), parsed.pct,
+                            parsed.k, parsed.thresh, parsed.iters,
+                            parsed.space, parsed.engine, parsed.budget, init,
+                            mode)
+        elapsed = time.perf_counter() - start
+        clusterer, img, found, rounds = result
+        print(f'{parsed.engine}/{init}/{mode}: {len(found)} clusters from '
+              f'{img.width}x{img.height} pixels in '
+              f'{1000 * elapsed:.1f} ms, {len(rounds)} rounds, '
+              f'mean distance {mean_distance(clusterer, img):.4f}')
+        return result
+
+    if parsed.compare:
+        # The same seed for each, so they see the same pixel sample.
+        for mode in Modes:
+            for init in Inits:
+                run(init, mode)
+        return
+
+    clusterer, pixbuf_img, clusters, rounds = run(parsed.init, parsed.mode)
+    scaled_width, scaled_height = pixbuf_img.width, pixbuf_img.height
     colorspace = space_for(parsed.space)
     for c in clusters:
         dist_dict = {}
@@ -409,7 +979,7 @@ def main(args):
 
     for row in range(scaled_height):
         for col in range(scaled_width):
-            clust = clusterer.cluster_assignments[(col, row)]
+            clust = clusterer.cluster_at(col, row)
             a, b, c = clust.centroid()
             rgb = colorspace.to_rgb_256_tuple(a, b, c)
             im.putpixel((col, row), rgb)
@@ -12,6 +12,10 @@ class ConfigKey:
     CONN_PORT = 'port'
     CONN_HB = 'hb'
     CONNECTED = 'connected'
+    MPD_BACKEND = 'mpd_backend'
+    ART_SOURCES = 'art_sources'
+    ART_CACHE_MB = 'art_cache_mb'
+    WARM_COVERS = 'warm_covers'
 
 
 def main_config_file():
@@ -31,6 +35,19 @@ def user_config_dir():
     return os.path.join(user_home(), ".config")
 
 
+def neonmeate_cache_dir():
+    return os.path.join(user_cache_dir(), 'neonmeate')
+
+
+def user_cache_dir():
+    cache_home = os.getenv('XDG_CACHE_HOME')
+
+    if cache_home:
+        return os.path.abspath(cache_home)
+
+    return os.path.join(user_home(), ".cache")
+
+
 def user_home():
     return os.path.expanduser("~")
 
@@ -48,6 +65,23 @@ class Config:
 
         ConfigKey.CONNECTED: False,
 
+        # Either 'blocking' or 'asyncio'. The asyncio backend sends
+        # status queries and player commands on a connection of their
+        # own, so they don't wait behind slow work on the executor.
+        ConfigKey.MPD_BACKEND: 'blocking',
+
+        # Where to look for album art, in order: 'local' reads it from
+        # the music directory, 'mpd' downloads it from the server.
+        ConfigKey.ART_SOURCES: ['local', 'mpd'],
+
+        # How much memory decoded album art may take, in MiB.
+        ConfigKey.ART_CACHE_MB: 128,
+
+        # Whether to look for the cover of every album in the music
+        # directory in the background after connecting, so that
+        # finding them later doesn't touch the disk.
+        ConfigKey.WARM_COVERS: False,
+
         'background_cache': {},
 
         ConfigKey.CONN_SETTINGS: {
@@ -111,6 +145,18 @@ class Config:
     def mpd_hb_interval(self):
         return self._config.get(ConfigKey.CONN_HB, 500)
 
+    def mpd_backend(self):
+        return self[ConfigKey.MPD_BACKEND]
+
+    def art_sources(self):
+        return self[ConfigKey.ART_SOURCES]
+
+    def art_cache_bytes(self):
+        return int(self[ConfigKey.ART_CACHE_MB] * 2 ** 20)
+
+    def warm_covers(self):
+        return self[ConfigKey.WARM_COVERS]
+
     def mpd_host(self):
         return self[ConfigKey.CONN_SETTINGS][ConfigKey.CONN_HOST]
 
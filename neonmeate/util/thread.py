@@ -1,7 +1,9 @@
-import queue
+import asyncio
+import logging
 import sched
 import threading
 import time
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 
 from ..ui.toolkit import glib_main
@@ -20,15 +22,146 @@ def signal_subcribe_on_main(connect_fn, signal_name, callback, *args):
     return connect_fn(signal_name, run_on_main_thread, *args)
 
 
-class EventLoopThread(threading.Thread):
+def on_main_when_done(future, callback, error_handler=None):
+    """
+    Calls the callback with the result of a concurrent.futures.Future
+    on the main GLib thread once the future is done. If the future
+    fails, the error handler is given the exception instead.
+    """
+
+    @glib_main
+    def deliver(result):
+        callback(result)
+
+    def on_done(f):
+        if f.cancelled():
+            return
+        e = f.exception()
+        if e is None:
+            deliver(f.result())
+        elif error_handler is not None:
+            error_handler(e)
+
+    future.add_done_callback(on_done)
+
+
+class AsyncioLoopThread(threading.Thread):
+    """
+    Runs an asyncio event loop. Coroutines can be submitted to it
+    from any thread and a concurrent.futures.Future is returned.
+    """
+
     def __init__(self, error_handler):
+        super(AsyncioLoopThread, self).__init__(name='AsyncioLoop',
+                                                daemon=True)
+        self._loop = asyncio.new_event_loop()
+        self._error_handler = error_handler
+        self._loop.set_exception_handler(self._on_loop_error)
+
+    def _on_loop_error(self, loop, context):
+        self._error_handler(context.get('exception', context['message']))
+
+    def run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class TaskQueue:
+    """
+    A bounded queue of tasks. A task may be added with a key, in which
+    case it replaces a task with the same key that is still waiting,
+    taking over its place in line rather than being run as well.
+
+    When the queue is full, the oldest keyed task is dropped to make
+    room, since keyed tasks are the kind that get asked for again. If
+    no keyed task is waiting, the new task is dropped instead. Counts
+    of coalesced and dropped tasks are kept.
+    """
+
+    def __init__(self, maxsize):
+        self._maxsize = maxsize
+        self._cond = threading.Condition()
+        self._entries = deque()
+        self._by_key = {}
+        self._size = 0
+        self._coalesced = 0
+        self._dropped = 0
+
+    def __len__(self):
+        return self._size
+
+    def put(self, action, key=None):
+        """Returns False if the task was dropped."""
+        with self._cond:
+            if key is not None and key in self._by_key:
+                self._by_key[key][1] = action
+                self._coalesced += 1
+                return True
+            if self._size >= self._maxsize and not self._drop_oldest_keyed():
+                self._dropped += 1
+                return False
+            entry = [key, action]
+            self._entries.append(entry)
+            if key is not None:
+                self._by_key[key] = entry
+            self._size += 1
+            self._cond.notify()
+            return True
+
+    def get(self):
+        """Blocks until a task is available and returns it."""
+        with self._cond:
+            while self._size == 0:
+                self._cond.wait()
+            key, action = self._entries.popleft()
+            while action is None:
+                key, action = self._entries.popleft()
+            if key is not None:
+                del self._by_key[key]
+            self._size -= 1
+            return action
+
+    def _drop_oldest_keyed(self):
+        for entry in self._entries:
+            key = entry[0]
+            if key is not None and entry[1] is not None:
+                del self._by_key[key]
+                # Left in place and skipped over by get().
+                entry[0] = entry[1] = None
+                self._size -= 1
+                self._dropped += 1
+                return True
+        return False
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': self._size,
+                'coalesced': self._coalesced,
+                'dropped': self._dropped
+            }
+
+
+class EventLoopThread(threading.Thread):
+    def __init__(self, error_handler, maxsize=1000):
         super(EventLoopThread, self).__init__(name='EventLoop', daemon=True)
-        self._queue = queue.SimpleQueue()
+        self._queue = TaskQueue(maxsize)
         self._running = False
         self._error_handler = error_handler
 
-    def add(self, action):
-        self._queue.put(action)
+    def add(self, action, key=None):
+        if not self._queue.put(action, key):
+            logging.getLogger(__name__).warning(
+                'event loop queue is full, dropped a task')
+
+    def stats(self):
+        return self._queue.stats()
 
     def run(self):
         self._running = True
@@ -90,11 +223,17 @@ class ScheduledExecutor:
 
         return self._executor.submit(wrapped)
 
-    def execute(self, action):
+    def execute(self, action, key=None):
         """
-        Executes a task on the event loop thread.
+        Executes a task on the event loop thread. If a key is given
+        and a task with the same key is still waiting to run, the new
+        task replaces it.
         """
-        self._thread.add(action)
+        self._thread.add(action, key)
+
+    def stats(self):
+        """Counts of queued, coalesced and dropped event loop tasks."""
+        return self._thread.stats()
 
     def schedule(self, delay, action):
         """
@@ -145,8 +284,12 @@ class ScheduledTask:
         self._eventloop = eventloop
         self._action = action
 
+        # A repeating task that is still waiting to run when it comes
+        # due again is only run once.
+        key = self if repeat else None
+
         def run():
-            self._eventloop.add(action)
+            self._eventloop.add(action, key)
 
         if repeat:
             self._schedule_periodic(run)
@@ -0,0 +1,283 @@
+import cairo
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+
+import gi
+
+gi.require_version('Gdk', '3.0')
+gi.require_version('GdkPixbuf', '2.0')
+gi.require_foreign('cairo')
+
+from gi.repository import Gdk, GdkPixbuf, GLib
+
+from .config import neonmeate_cache_dir
+
+
+class ThumbnailStore:
+    """
+    Keeps scaled down copies of cover artwork as small PNG files, so
+    the album grid can load a tile-sized image instead of decoding
+    the original, which is often several megabytes.
+
+    A thumbnail is named after a hash of the original's path, its
+    modification time and the thumbnail size. Replacing the original
+    therefore makes a new thumbnail rather than reusing the old one.
+
+    Thumbnails are made on demand by get(), which does file I/O and
+    decoding and so is meant to be called from worker threads.
+    """
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(neonmeate_cache_dir(), 'thumbnails')
+        self._cache_dir = cache_dir
+        self._log = logging.getLogger(__name__)
+
+    def _path_for(self, src_path, size, mtime):
+        key = f'{src_path}\0{mtime}\0{size}'.encode('utf-8')
+        name = hashlib.sha1(key).hexdigest()
+        return os.path.join(self._cache_dir, name[:2], f'{name}.png')
+
+    def get(self, src_path, size):
+        """
+        Returns the path of a thumbnail of the image that fits in a
+        square of size pixels, making it first if there isn't one.
+        Returns None if the image can't be read.
+        """
+        try:
+            mtime = os.stat(src_path).st_mtime_ns
+        except OSError:
+            return None
+        path = self._path_for(src_path, size, mtime)
+        if os.path.exists(path):
+            return path
+        try:
+            self._create(src_path, size, path)
+        except (GLib.GError, OSError) as e:
+            self._log.warning(f'could not make a thumbnail of {src_path}:'
+                              f' {e}')
+            return None
+        return path
+
+    def _create(self, src_path, size, path):
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(src_path, size, size,
+                                                         True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under another name first so that a thumbnail that
+        # exists is always complete.
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        pixbuf.savev(tmp, 'png', [], [])
+        os.replace(tmp, path)
+
+
+class ThumbnailAtlas:
+    """
+    Album grid tiles of one size, stored as raw ARGB32 pixels in a
+    single file that is memory mapped. A tile can be drawn straight
+    from the mapped file, so showing an album whose tile is in the
+    atlas takes no file opening or decoding at all.
+
+    The tiles file is append-only and every tile takes a slot of the
+    same size. The file grows by a batch of empty slots at a time, and
+    is only mapped again when those run out. The index file is a log
+    of JSON lines, each mapping an album directory to its slot; later
+    lines replace earlier ones.
+    Along with the slot, the index records the thumbnail the tile was
+    made from, which identifies the version of the cover it shows.
+    When the atlas is opened and most of the files are taken up by
+    tiles that were replaced or forgotten, both are rewritten with
+    only the live tiles.
+
+    Tiles are added from worker threads and read on the main thread.
+    Opening an atlas reads its files, so that is done in a worker too;
+    reading a tile only uses memory that is already mapped.
+    """
+
+    Format = cairo.FORMAT_ARGB32
+
+    # Compacting is not worth it for fewer stale slots or lines.
+    CompactMinStale = 64
+
+    # How many slots the tiles file grows by when it is full.
+    GrowSlots = 256
+
+    def __init__(self, size, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(neonmeate_cache_dir(), 'thumbnails')
+        self._size = size
+        self._stride = cairo.ImageSurface.format_stride_for_width(
+            ThumbnailAtlas.Format, size)
+        self._tile_bytes = self._stride * size
+        self._tiles_path = os.path.join(cache_dir, f'atlas-{size}.tiles')
+        self._index_path = os.path.join(cache_dir, f'atlas-{size}.index')
+        self._lock = threading.Lock()
+        self._index = {}
+        self._next_slot = 0
+        self._file_slots = 0
+        self._map = None
+        self._log = logging.getLogger(__name__)
+        self._load()
+
+    def _load(self):
+        os.makedirs(os.path.dirname(self._tiles_path), exist_ok=True)
+        try:
+            tiles_size = os.path.getsize(self._tiles_path)
+        except OSError:
+            tiles_size = 0
+        self._file_slots = tiles_size // self._tile_bytes
+        # The file has room for more tiles than it holds, so the slots
+        # in use are those the index has ever mentioned. A tile is
+        # written before its line, so they are all complete.
+        lines = 0
+        try:
+            with open(self._index_path, 'r') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        dirpath, entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry is None:
+                        self._index.pop(dirpath, None)
+                    elif entry[0] < self._file_slots:
+                        self._index[dirpath] = tuple(entry)
+                        self._next_slot = max(self._next_slot, entry[0] + 1)
+        except OSError:
+            pass
+        live = len(self._index)
+        stale = max(self._next_slot - live, lines - live)
+        if stale > max(live, ThumbnailAtlas.CompactMinStale):
+            self._compact()
+        self._remap()
+
+    def _compact(self):
+        """
+        Rewrites the tiles file with only the live tiles, in slots
+        from 0, and the index with one line for each.
+        """
+        entries = sorted(self._index.items(), key=lambda e: e[1][0])
+        tiles_tmp = f'{self._tiles_path}.tmp'
+        index_tmp = f'{self._index_path}.tmp'
+        index = {}
+        try:
+            with open(self._tiles_path, 'rb') as src, \
+                    open(tiles_tmp, 'wb') as tiles, \
+                    open(index_tmp, 'w') as log:
+                for slot, (dirpath, entry) in enumerate(entries):
+                    src.seek(entry[0] * self._tile_bytes)
+                    pixels = src.read(self._tile_bytes)
+                    tiles.write(pixels.ljust(self._tile_bytes, b'\0'))
+                    index[dirpath] = (slot,) + entry[1:]
+                    log.write(json.dumps([dirpath, index[dirpath]]) + '\n')
+            # Without an index the atlas is just empty, so removing it
+            # first means a crash can't pair it with the wrong tiles.
+            if os.path.exists(self._index_path):
+                os.remove(self._index_path)
+            os.replace(tiles_tmp, self._tiles_path)
+            os.replace(index_tmp, self._index_path)
+        except OSError as e:
+            self._log.warning(f'could not compact {self._tiles_path}: {e}')
+            return
+        self._log.info(f'compacted {self._tiles_path} from '
+                       f'{self._next_slot} to {len(index)} tiles')
+        self._index = index
+        self._next_slot = len(index)
+        self._file_slots = len(index)
+
+    def _remap(self):
+        try:
+            with open(self._tiles_path, 'rb') as f:
+                # Copy-on-write, so cairo can be given writable memory;
+                # pages are only copied if something draws on a tile.
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError):
+            # The file is missing or empty; nothing to map yet.
+            self._map = None
+
+    def key(self, dirpath):
+        entry = self._index.get(dirpath, None)
+        return entry[3] if entry else None
+
+    def tile(self, dirpath):
+        """
+        Returns a cairo surface over the album's tile in the mapped
+        file, or None if the atlas has no tile for it. The surface
+        does not have a border. This does no file I/O.
+        """
+        entry = self._index.get(dirpath, None)
+        mapped = self._map
+        if entry is None or mapped is None:
+            return None
+        slot, width, height, _ = entry
+        offset = slot * self._tile_bytes
+        if offset + self._tile_bytes > len(mapped):
+            return None
+        pixels = memoryview(mapped)[offset:offset + self._tile_bytes]
+        return cairo.ImageSurface.create_for_data(
+            pixels, ThumbnailAtlas.Format, width, height, self._stride)
+
+    def add(self, dirpath, thumbnail_path):
+        """
+        Adds a tile for the album from its thumbnail, unless the
+        atlas already has one made from that thumbnail. Meant to be
+        called from a worker thread.
+        """
+        if self.key(dirpath) == thumbnail_path:
+            return
+        try:
+            pixels, width, height = self._render(thumbnail_path)
+        except GLib.GError as e:
+            self._log.warning(f'could not add {thumbnail_path} to the '
+                              f'atlas: {e}')
+            return
+        with self._lock:
+            # Another worker may have added the same tile meanwhile.
+            if self.key(dirpath) == thumbnail_path:
+                return
+            slot = self._next_slot
+            self._next_slot += 1
+            grown = slot >= self._file_slots
+            fd = os.open(self._tiles_path, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                if grown:
+                    self._file_slots = slot + ThumbnailAtlas.GrowSlots
+                    os.ftruncate(fd, self._file_slots * self._tile_bytes)
+                os.pwrite(fd, pixels, slot * self._tile_bytes)
+            finally:
+                os.close(fd)
+            # A tile written within the mapped length shows through
+            # the mapping, whose pages are only copied once drawn on.
+            # Past it, the file is mapped again here, in the worker,
+            # so that the main thread never touches the file.
+            if grown:
+                self._remap()
+            entry = (slot, width, height, thumbnail_path)
+            self._append_index(dirpath, entry)
+            self._index[dirpath] = entry
+
+    def forget(self, dirpath):
+        with self._lock:
+            if self._index.pop(dirpath, None) is not None:
+                self._append_index(dirpath, None)
+
+    def _append_index(self, dirpath, entry):
+        with open(self._index_path, 'a') as f:
+            f.write(json.dumps([dirpath, entry]) + '\n')
+
+    def _render(self, thumbnail_path):
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+            thumbnail_path, self._size, self._size, True)
+        width, height = pixbuf.get_width(), pixbuf.get_height()
+        pixels = bytearray(self._tile_bytes)
+        surface = cairo.ImageSurface.create_for_data(
+            pixels, ThumbnailAtlas.Format, width, height, self._stride)
+        ctx = cairo.Context(surface)
+        Gdk.cairo_set_source_pixbuf(ctx, pixbuf, 0, 0)
+        ctx.paint()
+        surface.flush()
+        del ctx, surface
+        return pixels, width, height
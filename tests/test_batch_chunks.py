@@ -0,0 +1,48 @@
+import unittest
+
+from neonmeate.nmpd.mpdlib import Mpd
+
+
+class BatchChunksTest(unittest.TestCase):
+
+    def chunks(self, commands):
+        return list(Mpd._batch_chunks(commands))
+
+    def assert_covers(self, chunks, count):
+        self.assertEqual(0, chunks[0][0])
+        self.assertEqual(count, chunks[-1][1])
+        for (_, end), (start, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(end, start)
+
+    def test_no_commands(self):
+        self.assertEqual([], self.chunks([]))
+
+    def test_small_batch_is_one_list(self):
+        commands = [('add', f'song{i}.flac') for i in range(10)]
+        self.assertEqual([(0, 10)], self.chunks(commands))
+
+    def test_splits_by_command_count(self):
+        n = Mpd.BatchMaxCommands * 2 + 5
+        chunks = self.chunks([('deleteid', i) for i in range(n)])
+        self.assert_covers(chunks, n)
+        self.assertEqual(3, len(chunks))
+        for start, end in chunks:
+            self.assertLessEqual(end - start, Mpd.BatchMaxCommands)
+
+    def test_splits_by_size(self):
+        uri = 'x' * (Mpd.BatchMaxBytes // 4)
+        chunks = self.chunks([('add', uri) for _ in range(10)])
+        self.assert_covers(chunks, 10)
+        self.assertGreater(len(chunks), 1)
+        for start, end in chunks:
+            size = (end - start) * (len('add') + len(uri) + 4)
+            self.assertLessEqual(size, Mpd.BatchMaxBytes)
+
+    def test_oversized_command_goes_alone(self):
+        big = ('add', 'x' * (Mpd.BatchMaxBytes + 1))
+        chunks = self.chunks([('add', 'a'), big, ('add', 'b')])
+        self.assertEqual([(0, 1), (1, 2), (2, 3)], chunks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+
+from neonmeate.nmpd.playqueue import PlayQueue
+
+
+def song(songid, pos):
+    return {'id': str(songid), 'pos': str(pos), 'file': f'song{songid}.flac'}
+
+
+class FakeClient:
+    def __init__(self, queue, moves=None):
+        self.queue = queue
+        self.moves = moves or []
+        self.playlistinfo_calls = 0
+
+    def playlistinfo(self):
+        self.playlistinfo_calls += 1
+        return [dict(e) for e in self.queue]
+
+    def plchangesposid(self, version):
+        return self.moves
+
+
+def status(version, length):
+    return {'playlist': str(version), 'playlistlength': str(length)}
+
+
+class PlayQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = PlayQueue()
+        self.client = FakeClient([song(1, 0), song(2, 1), song(3, 2)])
+        self.fetched = []
+
+    def fetch(self, ids):
+        self.fetched.append(list(ids))
+        return [song(i, 0) for i in ids if int(i) < 100]
+
+    def sync(self, version, length):
+        return self.queue.sync(self.client, status(version, length),
+                               self.fetch)
+
+    def files(self):
+        return [e['file'] if e else None for e in self.queue.entries()]
+
+    def test_first_sync_fetches_everything(self):
+        changes = self.sync(1, 3)
+        self.assertTrue(changes.reset)
+        self.assertEqual(3, changes.length)
+        self.assertEqual(['song1.flac', 'song2.flac', 'song3.flac'],
+                         self.files())
+        self.assertEqual('1', self.queue.version())
+
+    def test_unchanged_version_is_not_synced(self):
+        self.sync(1, 3)
+        self.assertIsNone(self.sync(1, 3))
+        self.assertEqual(1, self.client.playlistinfo_calls)
+
+    def test_moves_known_songs_and_fetches_only_new_ones(self):
+        self.sync(1, 3)
+        # Song 2 was deleted, 3 moved to the front and 4 appended.
+        self.client.moves = [{'id': '3', 'cpos': '0'},
+                             {'id': '1', 'cpos': '1'},
+                             {'id': '4', 'cpos': '2'}]
+        changes = self.sync(2, 3)
+        self.assertFalse(changes.reset)
+        self.assertEqual([['4']], self.fetched)
+        self.assertEqual(['song3.flac', 'song1.flac', 'song4.flac'],
+                         self.files())
+        self.assertEqual(['0', '1', '2'],
+                         [e['pos'] for e in self.queue.entries()])
+        self.assertEqual(1, self.client.playlistinfo_calls)
+
+    def test_truncates_to_the_new_length(self):
+        self.sync(1, 3)
+        self.client.moves = []
+        changes = self.sync(2, 1)
+        self.assertEqual(1, changes.length)
+        self.assertEqual(['song1.flac'], self.files())
+
+    def test_unknown_id_falls_back_to_a_full_fetch(self):
+        self.sync(1, 3)
+        self.client.moves = [{'id': '100', 'cpos': '0'}]
+        self.client.queue = [song(5, 0)]
+        changes = self.sync(2, 1)
+        self.assertTrue(changes.reset)
+        self.assertEqual(['song5.flac'], self.files())
+        self.assertEqual(2, self.client.playlistinfo_calls)
+        self.assertEqual('2', self.queue.version())
+
+    def test_clear_forces_a_full_fetch(self):
+        self.sync(1, 3)
+        self.queue.clear()
+        self.assertTrue(self.sync(1, 3).reset)
+
+
+if __name__ == '__main__':
+    unittest.main()
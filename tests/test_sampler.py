@@ -0,0 +1,82 @@
+import random
+import unittest
+
+from neonmeate.nmpd.sampler import SongSampler
+
+
+class SongSamplerTest(unittest.TestCase):
+
+    def sampler(self, n, recent_limit=1000):
+        s = SongSampler(recent_limit=recent_limit)
+        s.refresh((f'song{i}.flac' for i in range(n)), '1')
+        return s
+
+    def assert_consistent(self, s):
+        self.assertEqual(set(s._recent), set(s._recent_counts))
+        self.assertEqual(len(s._recent), sum(s._recent_counts.values()))
+
+    def test_uris_round_trip(self):
+        s = self.sampler(5)
+        self.assertEqual(5, len(s))
+        self.assertEqual('song3.flac', s.uri(3))
+
+    def test_stamp(self):
+        s = SongSampler()
+        self.assertTrue(s.is_stale('1'))
+        s.refresh([], '1')
+        self.assertFalse(s.is_stale('1'))
+        self.assertTrue(s.is_stale('2'))
+
+    def test_picks_are_distinct(self):
+        picked = self.sampler(1000).sample(50, random.Random(1))
+        self.assertEqual(50, len(set(picked)))
+
+    def test_fewer_songs_than_asked_for(self):
+        picked = self.sampler(3).sample(10, random.Random(1))
+        self.assertEqual({'song0.flac', 'song1.flac', 'song2.flac'},
+                         set(picked))
+
+    def test_avoids_recent_songs(self):
+        s = self.sampler(10000)
+        rng = random.Random(2)
+        seen = set()
+        for _ in range(19):
+            picked = set(s.sample(50, rng))
+            self.assertFalse(seen & picked)
+            seen |= picked
+
+    def test_avoids_recent_songs_in_a_small_library(self):
+        s = self.sampler(12, recent_limit=10)
+        rng = random.Random(3)
+        first = set(s.sample(5, rng))
+        second = set(s.sample(5, rng))
+        self.assertFalse(first & second)
+
+    def test_fills_with_the_songs_played_longest_ago(self):
+        s = self.sampler(12, recent_limit=10)
+        rng = random.Random(3)
+        first = s.sample(5, rng)
+        second = s.sample(5, rng)
+        third = set(s.sample(5, rng))
+        fresh = {s.uri(i) for i in range(12)} - set(first) - set(second)
+        self.assertEqual(2, len(fresh))
+        self.assertTrue(fresh <= third)
+        self.assertTrue(third - fresh <= set(first))
+
+    def test_recent_counts_follow_the_deque(self):
+        s = self.sampler(12, recent_limit=10)
+        rng = random.Random(4)
+        for _ in range(200):
+            s.sample(rng.randint(1, 12), rng)
+            self.assert_consistent(s)
+
+    def test_refresh_forgets_recent_songs(self):
+        s = self.sampler(10)
+        s.sample(5, random.Random(5))
+        s.refresh(['a', 'b'], '2')
+        self.assertEqual(0, len(s._recent))
+        self.assert_consistent(s)
+
+
+if __name__ == '__main__':
+    unittest.main()
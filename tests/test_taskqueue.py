@@ -0,0 +1,80 @@
+import threading
+import unittest
+
+from neonmeate.util.thread import TaskQueue
+
+
+def task(name):
+    return lambda: name
+
+
+class TaskQueueTest(unittest.TestCase):
+
+    def drain(self, queue):
+        names = []
+        while len(queue):
+            names.append(queue.get()())
+        return names
+
+    def test_first_in_first_out(self):
+        q = TaskQueue(10)
+        for name in 'abc':
+            q.put(task(name))
+        self.assertEqual(['a', 'b', 'c'], self.drain(q))
+
+    def test_keyed_task_replaces_the_waiting_one_in_place(self):
+        q = TaskQueue(10)
+        q.put(task('a'), 'k')
+        q.put(task('b'))
+        q.put(task('c'), 'k')
+        self.assertEqual(2, len(q))
+        self.assertEqual(['c', 'b'], self.drain(q))
+        self.assertEqual(1, q.stats()['coalesced'])
+
+    def test_key_can_be_used_again_once_run(self):
+        q = TaskQueue(10)
+        q.put(task('a'), 'k')
+        self.assertEqual(['a'], self.drain(q))
+        q.put(task('b'), 'k')
+        self.assertEqual(['b'], self.drain(q))
+
+    def test_full_queue_drops_the_oldest_keyed_task(self):
+        q = TaskQueue(3)
+        q.put(task('a'))
+        q.put(task('b'), 'k1')
+        q.put(task('c'), 'k2')
+        self.assertTrue(q.put(task('d')))
+        self.assertEqual(3, len(q))
+        self.assertEqual(['a', 'c', 'd'], self.drain(q))
+        self.assertEqual(1, q.stats()['dropped'])
+
+    def test_dropped_key_can_be_used_again(self):
+        q = TaskQueue(2)
+        q.put(task('a'), 'k')
+        q.put(task('b'))
+        q.put(task('c'))
+        self.assertEqual('b', q.get()())
+        q.put(task('d'), 'k')
+        self.assertEqual(['c', 'd'], self.drain(q))
+
+    def test_full_queue_without_keyed_tasks_drops_the_new_one(self):
+        q = TaskQueue(2)
+        q.put(task('a'))
+        q.put(task('b'))
+        self.assertFalse(q.put(task('c')))
+        self.assertEqual(['a', 'b'], self.drain(q))
+        self.assertEqual({'queued': 0, 'coalesced': 0, 'dropped': 1},
+                         q.stats())
+
+    def test_get_waits_for_a_task(self):
+        q = TaskQueue(2)
+        got = []
+        consumer = threading.Thread(target=lambda: got.append(q.get()()))
+        consumer.start()
+        q.put(task('a'))
+        consumer.join(5)
+        self.assertEqual(['a'], got)
+
+
+if __name__ == '__main__':
+    unittest.main()